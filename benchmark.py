@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmark.py
+Measures how long each stage of generating a letter takes. Runs the full
+parse_letter -> parse_input -> fill_missing -> compose_letter pipeline over every
+template in templates/ inside a temporary folder with a synthetic dictionary.db
+and local names only, so no network or real database is needed.
+
+Reports per stage latency percentiles, the throughput of the whole pipeline
+and the peak memory use of the process as json. Run through letters.py:
+	python letters.py --bench
+"""
+
+import json
+import time
+import random
+import shutil
+import string
+import sys
+import os
+import glob
+import tempfile
+import resource
+
+import sqlite3 as lite
+
+import letters
+import sinks
+
+
+# Sample submissions for parse_input.
+SUBMISSIONS = [
+	"Here are your sealions, sir.",
+	"The quick brown fox jumps over the lazy dog",
+	"I quietly remembered the beautiful old harbour",
+	"Bring more cheese and happier colleagues",
+	"She was running faster than expected",
+	"purple",
+	"Nobody really understood the strange new regulations",
+	"Walking slowly, we discussed bigger plans"
+]
+
+
+def create_dictionary(path, words_per_tag=2000):
+	"""Create a synthetic dictionary.db of random lowercase words for each valid tag.
+	Args:
+		path (string): path to the database
+		words_per_tag (int): number of words to create for each tag
+	"""
+	rng = random.Random(0)
+	con = lite.connect(path)
+	with con:
+		con.execute("CREATE TABLE dictionary (word TEXT, class TEXT)")
+		for tag in letters.LetterRandomizer.TAGS:
+			rows = [("".join(rng.choice(string.ascii_lowercase) for i in range(rng.randint(3, 10))), tag) for n in range(words_per_tag)]
+			con.executemany("INSERT INTO dictionary VALUES (?, ?)", rows)
+	con.close()
+
+
+def setup(base):
+	"""Copy templates and names to a temporary toplevel folder and create a dictionary.db.
+	Arg:
+		base (string): path to the real toplevel folder
+	Return:
+		path to the temporary folder
+	"""
+	tmp = tempfile.mkdtemp(prefix="letters_bench_") + "/"
+	shutil.copytree(base + "templates", tmp + "templates")
+	shutil.copytree(base + "names", tmp + "names")
+	os.mkdir(tmp + "data")
+	create_dictionary(tmp + "dictionary.db")
+	return tmp
+
+
+def percentiles(samples):
+	"""Summarize a list of durations.
+	Arg:
+		samples (list): durations in seconds
+	Return:
+		a dict of sample count, mean, p50, p90, p99 and max in milliseconds
+	"""
+	samples = sorted(samples)
+	n = len(samples)
+	def rank(p):
+		return samples[min(n - 1, int(p * n))] * 1000
+	return {
+		"n":n,
+		"mean":sum(samples) / n * 1000,
+		"p50":rank(0.50),
+		"p90":rank(0.90),
+		"p99":rank(0.99),
+		"max":samples[-1] * 1000
+	}
+
+
+def timed(samples, stage, f, *args, **kwargs):
+	"""Call f and add its duration to samples[stage].
+	Return:
+		the return value of f
+	"""
+	start = time.time()
+	value = f(*args, **kwargs)
+	samples.setdefault(stage, []).append(time.time() - start)
+	return value
+
+
+def run(base, rounds=3, seed=0):
+	"""Run the benchmark.
+	Args:
+		base (string): path to the toplevel folder with the templates
+		rounds (int): how many times to generate a letter from each template
+		seed (int): random seed for selecting words and input
+	Return:
+		the results as a dict
+	"""
+	random.seed(seed)
+	tmp = setup(base)
+	stdout = sys.stdout
+	try:
+		randomizer = letters.LetterRandomizer(tmp, sink=sinks.MemorySink(), seed=seed)
+		templates = sorted(glob.glob(tmp + "templates/*.txt"))
+		samples = {}
+
+		# letters.py prints its progress, keep it out of the results.
+		sys.stdout = open(os.devnull, "w")
+
+		# Tokenizing and tagging the templates happens once, time it separately.
+		for template in templates:
+			timed(samples, "index", randomizer.index.refresh, template)
+			randomizer.index.save(template)
+
+		# Load the words before timing fill_missing.
+		timed(samples, "load_dictionary", randomizer.get_sampler)
+
+		start = time.time()
+		for i in range(rounds):
+			for template in templates:
+				timed(samples, "parse_letter", randomizer.parse_letter, template)
+				for s in random.sample(SUBMISSIONS, 3):
+					timed(samples, "parse_input", randomizer.parse_input, s)
+				timed(samples, "fill_missing", randomizer.fill_missing)
+				timed(samples, "compose_letter", randomizer.compose_letter)
+				timed(samples, "generate_name", randomizer.get_names().generate)
+		elapsed = time.time() - start
+
+	finally:
+		sys.stdout = stdout
+		shutil.rmtree(tmp)
+
+	n = rounds * len(templates)
+	return {
+		"templates":len(templates),
+		"rounds":rounds,
+		"letters":n,
+		"seconds":elapsed,
+		"letters_per_second":n / elapsed,
+		"peak_rss_kb":resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+		"stages":dict((stage, percentiles(samples[stage])) for stage in samples)
+	}
+
+
+def main(base, rounds=3, output=None):
+	"""Run the benchmark and write the results as json to a file or stdout.
+	Args:
+		base (string): path to the toplevel folder with the templates
+		rounds (int): how many times to generate a letter from each template
+		output (string): path to the results file, None for stdout
+	"""
+	results = run(base, rounds)
+	if output:
+		with open(output, "w") as f:
+			json.dump(results, f, indent=2, sort_keys=True)
+	else:
+		print json.dumps(results, indent=2, sort_keys=True)
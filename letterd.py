@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+"""
+letterd.py
+A resident letter service. Keeps a LetterRandomizer with its tagger, template
+index and database words loaded and answers requests over a Unix socket, so
+callers such as cron jobs or the frontend don't pay the start up cost of
+letters.py on every run.
+
+Requests and responses are json objects, one per line. A request names a command:
+	{"command": "generate", "template": <optional filename>, "seed": <optional int>}
+		-> {"ok": true, "title": ..., "letter": ...}
+	{"command": "init", "template": <optional filename>}
+		-> {"ok": true, "title": ...}
+	{"command": "parse_input", "input": [<string>, ...]}
+		-> {"ok": true, "status": <words still needed>}
+	{"command": "fill"}
+		-> {"ok": true, "title": ..., "result": <value returned by the sink>}
+	{"command": "status"}
+		-> {"ok": true, "title": ..., "status": <words still needed>, "input": <words entered>}
+	{"command": "sessions"}
+		-> {"ok": true, "sessions": [[<id>, <title>, <filled>], ...]}
+The init, parse_input, fill and status requests work on change_frame.json of the
+working directory, or on the letter of a session if the request has a "session" ID.
+Errors are returned as {"ok": false, "error": <message>}.
+
+Usage:
+	python letterd.py --serve
+	python letterd.py --request status
+"""
+
+import json
+import argparse
+import socket
+import threading
+import os
+import SocketServer
+
+
+class LetterHandler(SocketServer.StreamRequestHandler):
+	"""Handles the requests of a single connection."""
+
+	def handle(self):
+		for line in iter(self.rfile.readline, ""):
+			if not line.strip():
+				continue
+			try:
+				request = json.loads(line)
+				with self.server.lock:
+					response = self.server.dispatch(request)
+				response["ok"] = True
+			except Exception as e:
+				response = {"ok":False, "error":"{}: {}".format(type(e).__name__, e)}
+			self.wfile.write(json.dumps(response) + "\n")
+			self.wfile.flush()
+
+
+
+class LetterServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	"""Serves requests for a LetterRandomizer. Connections are handled in threads,
+	requests are processed one at a time.
+	"""
+	daemon_threads = True
+
+	def __init__(self, socket_path, randomizer):
+		"""Args:
+			socket_path (string): path to the Unix socket to listen to
+			randomizer (letters.LetterRandomizer): the randomizer to serve
+		"""
+		if os.path.exists(socket_path):
+			os.remove(socket_path)
+		SocketServer.UnixStreamServer.__init__(self, socket_path, LetterHandler)
+		self.randomizer = randomizer
+		self.lock = threading.Lock()
+
+
+	def warm_up(self):
+		"""Load the taggers, template index, database words and names up front."""
+		randomizer = self.randomizer
+		randomizer.get_tagger()
+		randomizer.get_input_tagger()
+		randomizer.index.build(randomizer.catalog.templates())
+		randomizer.catalog.refresh(full=True)
+		randomizer.get_sampler()
+		randomizer.get_names()
+
+
+	def pick(self):
+		"""Return:
+			path to a random template, picked from the catalog after checking for new templates
+		"""
+		self.randomizer.catalog.refresh()
+		return self.randomizer.catalog.pick(self.randomizer.rng)
+
+
+	def resolve(self, template):
+		"""Find a requested template in the catalog. Only templates in the template folder
+		are served, whatever path the request names.
+		Arg:
+			template (string): filename or path of the template, None for a random template
+		Return:
+			path to the template
+		"""
+		if not template:
+			return self.pick()
+		path = self.randomizer.catalog.find(os.path.basename(template))
+		if path is None:
+			raise ValueError("Unknown template: {}".format(template))
+		return path
+
+
+	def dispatch(self, request):
+		"""Process a request.
+		Arg:
+			request (dict): the decoded request
+		Return:
+			the response as a dict
+		"""
+		randomizer = self.randomizer
+		command = request.get("command")
+		randomizer.use_session(request.get("session"))
+
+		if command == "generate":
+			template = self.resolve(request.get("template"))
+			title, letter = randomizer.generate(template, request.get("seed"))
+			return {"title":title, "letter":letter}
+
+		elif command == "init":
+			template = self.resolve(request.get("template"))
+			return {"title":randomizer.parse_letter(template)}
+
+		elif command == "parse_input":
+			inputs = request.get("input", [])
+			if not isinstance(inputs, list):
+				inputs = [inputs]
+			randomizer.parse_inputs(inputs)
+			return {"status":randomizer.get_template_status()}
+
+		elif command == "fill":
+			randomizer.fill_missing()
+			return {"title":randomizer.get_frame().title, "result":randomizer.compose_letter()}
+
+		elif command == "status":
+			state = randomizer.get_frame()
+			return {"title":state.title, "status":randomizer.get_template_status(), "input":len(state.input)}
+
+		elif command == "sessions":
+			return {"sessions":randomizer.get_store().list()}
+
+		raise ValueError("Unknown command: {}".format(command))
+
+
+
+def request(socket_path, command, **kwargs):
+	"""Send a request to a running service.
+	Args:
+		socket_path (string): path to the service's Unix socket
+		command (string): the command, see above
+		kwargs: other fields of the request
+	Return:
+		the response as a dict
+	"""
+	kwargs["command"] = command
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.connect(socket_path)
+		f = sock.makefile("rw")
+		f.write(json.dumps(kwargs) + "\n")
+		f.flush()
+		return json.loads(f.readline())
+	finally:
+		sock.close()
+
+
+def serve(socket_path, path, wd):
+	"""Start the service and serve until interrupted.
+	Args:
+		socket_path (string): path to the Unix socket to listen to
+		path (string): path to the toplevel directory
+		wd (string): working directory relative to path
+	"""
+	import letters
+	server = LetterServer(socket_path, letters.LetterRandomizer(path, wd))
+	print "Loading..."
+	server.warm_up()
+	print "Listening on", socket_path
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		os.remove(socket_path)
+
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Resident letter randomizer service.")
+	parser.add_argument("--serve", help="Start the service.", action="store_true")
+	parser.add_argument("--request", help="Send a request to a running service and print the response.", metavar="command")
+	parser.add_argument("--input", help="Input string for a parse_input request.", action="append")
+	parser.add_argument("--template", help="Filename of a template in templates/ for a generate or init request.")
+	parser.add_argument("--session", help="Session ID of the letter to work on.")
+	parser.add_argument("--socket", help="Path to the Unix socket.", default="/tmp/letterd.sock")
+	parser.add_argument("--wd", help="Working directory of the service relative to the toplevel directory.", default="data/")
+	args = parser.parse_args()
+
+	if args.serve:
+		serve(args.socket, "/home/pi/python/letters/", args.wd)
+
+	elif args.request:
+		kwargs = {}
+		if args.input:
+			kwargs["input"] = args.input
+		if args.template:
+			kwargs["template"] = args.template
+		if args.session:
+			kwargs["session"] = args.session
+		response = request(args.socket, args.request, **kwargs)
+		if response.get("letter"):
+			print response["letter"].encode("utf8")
+		else:
+			print json.dumps(response, indent=2)
+
+	else:
+		parser.print_help()
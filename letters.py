@@ -24,13 +24,20 @@ File structure:
 * Parsing a templete creates an internal bookkeeping file in the data folder:
 	change_frame.json contains information about the position and type of words
 	that needs to changed.
+* data/index/ stores each template tokenized and tagged, an entry is (re)built
+  automatically whenever its template changes, or with --build-index.
+  data/catalog.db lists the templates with their titles for picking.
 * The generated letters are also stored in the data folder
 * dictionary.db is a database that can be used as an input source
+* names/names.json contains first names and surnames by usage region for
+  receivers and signatures
+* tagger.pickle caches the nltk tagger model for faster loading
 
 Requirements:
 * nltk - http://www.nltk.org/install.html
 * markdown - http://pythonhosted.org/Markdown/install.html
 * beautifulsoup - https://www.crummy.com/software/BeautifulSoup/bs4/doc/
+  (only for fetching names from behindthename.com)
 
 
 Change log
@@ -65,22 +72,30 @@ Change log
 """
 
 
-import requests
 import json
 import argparse
-import glob
 import time
 import pprint
 import codecs
 import random
 import os.path
-
-import nltk
-import markdown
-import bs4
+import hashlib
+import threading
+import Queue
+import bisect
+import collections
+import re
+import cgi
+import contextlib
+import logging
+import cPickle
 
 import sqlite3 as lite
 
+import sinks
+import lexicon
+import sessions
+
 
 class LetterRandomizer():
 
@@ -88,288 +103,386 @@ class LetterRandomizer():
 	# Define valid nltk word tags for switching.
 	TAGS = ("JJ", "JJR", "JJS", "NN", "NNS", "RB", "RBR", "VB", "VBN", "VBD", "VBG")
 
-	def __init__(self, path, wd = "data/"):
-		"""Defines file paths to auxilary files."""
+	# Name usage regions and their relative weights for random names,
+	# see names/names.json and http://www.behindthename.com/random/.
+	NAME_USAGE = {
+		"chi":1,
+		"dan":1,
+		"dut":1,
+		"end":1,
+		"est":1,
+		"get":1,
+		"hun":1,
+		"ind":1,
+		"ita":1,
+		"jew":1,
+		"nor":1,
+		"per":1,
+		"rus":1,
+		"spa":1
+	}
+
+	def __init__(self, path, wd = "data/", name_prefetch = 0, sink = None, stats = None, seed = None, session = None, weighted = False):
+		"""Defines file paths to auxilary files.
+		Args:
+			path (string): path to the toplevel directory
+			wd (string): working directory relative to path
+			name_prefetch (int): size of a pool of names to prefetch from behindthename.com
+				in the background, 0 to only use local names
+			sink: where to output composed letters, see sinks.py. Defaults to a
+				sinks.FileSink storing .txt files in the working directory.
+			stats (Stats): collects timings and counters of each stage, None to disable
+			seed (int): seed for all random choices, None to use the random module.
+				With a seed the same template and input always produce the same letter
+				and remote names are not used.
+			session (string): ID of the letter to work on in the session store of the working
+				directory, None to use change_frame.json
+			weighted (boolean): whether to draw database words weighted by their frequency or rating,
+				see WeightedSampler
+		"""
 		self.base = path # path to the toplevel directory where all folders lie
+		self.wd_name = wd  # for recreating the randomizer in worker processes, see generate_batch()
 		self.wd = path + wd  # working directory: generated letters + change_frame data gets stored here. (the bot gets its own folder)
 		self.frame = self.wd + "change_frame.json"
+		self.session = session
+		self.store = None  # the SessionStore, see get_store()
+		self.stats = stats
+		# Kept out of templates/ so that writing them doesn't change the folder's modification time.
+		self.index = TemplateIndex(self.wd + "index/", stats, path + "tagger.pickle")
+		self.catalog = TemplateCatalog(self.wd + "catalog.db", path + "templates/", self.index, stats)
+		self.skeletons = SkeletonCache(stats=stats)
+		self.con = None  # connection to dictionary.db, see connect()
+		self.state = None  # the current ChangeFrame, see get_frame()
+		self.sampler = None  # words from dictionary.db or dictionary.lex grouped by tag, see get_sampler()
+		self.names = None  # see get_names()
+		self.input_tagger = None  # see get_input_tagger()
+		self.name_prefetch = name_prefetch
+		self.weighted = weighted
+		self.sink = sink if sink is not None else sinks.FileSink(self.wd)
+		self.seed = seed
+		self.rng = random  # source of all random choices, see reseed()
 
 
 	def parse_letter(self, template, splice_percentage = 0.35):
-		"""Processes a letter template to a change frame. Reads a markdown encoded letter from file,
-		randomly selects the indices of words to change from each paragraph and stores the result
-		to a change_frame.json file.
+		"""Processes a letter template to a change frame. Reads the tokenized letter from the
+		template index, randomly selects the indices of words to change from each paragraph and
+		stores the result to a change_frame.json file.
 		Args:
 			template (string): path to the template file
 			splice_percentage (float): percentage of words to change
 		Return:
 			the title for the finished letter
 		"""
-		# Decode template as a unicode object.
-		with codecs.open(template, encoding="utf8") as f:
-			text = f.read()
+		self.state = self.make_frame(template, splice_percentage)
 
-		# nltk.word_tokenze() ignores newline characters. To keep track of paragraphs,
-		# split text by newlines.
-		text = text.split("\n")
-
-		# Define characters for words that should be ignored when determining nltk tags,
-		# most of these shouldn't receive a valid tag anyway.
-		invalid_tokens = [ 
-			"<",
-			">",
-			"span",
-			"class",
-			"id",
-			"signature",
-			"receiver",
-			"/",
-			"#",
-			"@",
-			"`",
-			"'"
-		]
-		# Tokenize each paragraph to create a frame of words to change.
+		# Store parsed data to change_frame.json.
+		self.save_frame(new=True)
+
+		return self.state.title
+
+
+	def make_frame(self, template, splice_percentage = 0.35):
+		"""Create a change frame for a template without storing it, see parse_letter().
+		Args:
+			template (string): path to the template file
+			splice_percentage (float): percentage of words to change
+		Return:
+			a ChangeFrame
+		"""
+		self.reseed(0)
+		entry = self.index.get(template)
+		self.catalog.check(template)
+
+		# Select words to change from each paragraph.
 		change_frame = []
-		for pidx, p in enumerate(text):
-			# Replace occurances of ' to ` in order to keep nltk from tokenizing contractions
-			# into two (ie. "they're" -> ["they", "'re"]). The former part could then be chosen
-			# to be a valid switch word.
-			#p = p.replace("'", "`")  # update: normalize_tokens takes care of this
-			tokens = LetterRandomizer.normalize_tokens(nltk.word_tokenize(p))
-			tagged = nltk.pos_tag(tokens)
-
-			# A list of (paragraph_idx, word_idx, nltk_tag) tuples from words valid words.
-			valid = [(pidx, idx, token[1]) for idx, token in enumerate(tagged) if token[1] in LetterRandomizer.TAGS
-				and not any(item in token[0] for item in invalid_tokens) ]
+		for pidx, p in enumerate(entry["paragraphs"]):
+			# A list of (paragraph_idx, word_idx, nltk_tag) tuples from valid words,
+			# in the order they appear in the paragraph.
+			valid = sorted([(pidx, idx, tag) for tag in p["slots"] for idx in p["slots"][tag]], key=lambda token: token[1])
 
 			# Randomly select splice_precentage% of valid tags.
 			n = int(splice_percentage * len(valid))
 			# Create a tuple of (paragraph index, [word index, nltk tag]) to add to change_frame.
-			p_token = random.sample(valid, n)
+			p_token = self.rng.sample(valid, n)
 			if p_token:
 				change_frame.extend(p_token)
 
-		# Read this template's title from templates/summary.json.
-		with open(self.base + "templates/summary.json", "r") as f:
-			summary = json.load(f)
-			fname = os.path.basename(template)
-		try:
-			title = summary[fname]
-
-		# Title not found in summary.json:
-		# use the filename as title.
-		except KeyError as e:
-			print e
-			title = fname 
-
-		# Store parsed data to change_frame.json.
-		d = {"title":title, "file":template, "change_frame":change_frame, "input":[]}
-		with open(self.frame, "w") as f:
-			json.dump(d, f)
+		return ChangeFrame(self.catalog.title(template), template, change_frame, [])
 
-		return title
 
-
-	def parse_input(self, s, first_only=False):
+	def parse_input(self, s, first_only=False, save=True):
 		"""Parses input s for words needed to fill missing data in change_frame.json.
 		Arg:
 			s (string): text to use as input
 			first_only (boolean): only parse the first word?
+			save (boolean): whether to store the change frame afterwards, when parsing several
+				inputs in a row call save_frame() once when done instead
+		"""
+		self.parse_inputs([s], first_only, save)
+
+
+	def parse_inputs(self, inputs, first_only=False, save=True):
+		"""Parses a list of inputs for words needed to fill missing data in change_frame.json.
+		All inputs are tagged in one go with the LookupTagger, and the words are then
+		matched to the blanks in the order of the inputs.
+		Arg:
+			inputs (list): strings to use as input
+			first_only (boolean): only parse the first word of each input?
+			save (boolean): whether to store the change frame afterwards
 		"""
-		with open(self.frame) as f:
-			template_data = json.load(f)
-			change_frame = template_data["change_frame"]
-			input_ = template_data["input"]
+		state = self.get_frame()
+		input_ = state.input
 
 		# Don't procede to call nltk if all gaps already filled.
-		if not change_frame:
+		if not state.has_slots() or not inputs:
 			return
 
-		print "Parsing:", s
-		tokens = LetterRandomizer.normalize_tokens(nltk.word_tokenize(s))
-		# Drop tokens with unwanted characters.
-		tokens = [ token for token in tokens if not any(item in token for item in ("//", "html", "@", "http")) ]
-		# Should only the first word be considered?
-		if first_only:
-			tokens = tokens[:1]
-		tagged = nltk.pos_tag(tokens)
+		import nltk
+		tagger = self.get_input_tagger()
+		sentences = []
+		with timer(self.stats, "tokenize"):
+			for s in inputs:
+				print "Parsing:", s
+				tokens = LetterRandomizer.normalize_tokens(nltk.word_tokenize(s))
+				# Drop tokens with unwanted characters.
+				tokens = [ token for token in tokens if not any(item in token for item in ("//", "html", "@", "http")) ]
+				# Should only the first word be considered?
+				if first_only:
+					tokens = tokens[:1]
+				sentences.append(tokens)
+
+		with timer(self.stats, "tag"):
+			tagged_sentences = tagger.tag_sents(sentences)
 
 		# Check if tagged words match those needed to fill blanks.
-		for word, tag in tagged:
-			# Get all change_frame tuples with matching tag.
-			valid = [token for token in change_frame if token[2] == tag]
-
-			# Replace the topmost item in valid with the tagged word.
-			if valid:
-				data = valid.pop()
-				new = (data[0], data[1], word) # (paragraph_idx, word_idx, word)
-				#print new
-			
-				# Add new word to input and remove old data from change_frame.
-				input_.append(new)
-				change_frame.remove(data)
+		for tagged in tagged_sentences:
+			for word, tag in tagged:
+				# Take the latest open slot with matching tag and replace it with the tagged word.
+				data = state.take(tag)
+				if data:
+					new = (data[0], data[1], word) # (paragraph_idx, word_idx, word)
+
+					# Add new word to input.
+					input_.append(new)
+					count(self.stats, "slots_input")
 
 		# Store new change_frame and template back to file.
-		#d = {"template":template, "change_frame":change_frame}
-		template_data["change_frame"] = change_frame
-		template_data["input"] = input_
-		with open(self.frame, "w") as f:
-			json.dump(template_data, f)
+		if save:
+			self.save_frame()
 
 
 	def fill_missing(self):
 		"""Reads missing word data from change_frame.json and fetches matching words from the database.
 		Note: does not generate an actual letter file, see compose_letter().
 		"""
-		with open(self.frame, "r") as f:
-			template_data = json.load(f)
-			change_frame = template_data["change_frame"]
-			input_ = template_data["input"]
+		state = self.get_frame()
+		if not state.has_slots():
+			return
+
+		self.fill_frame(state)
 
+		# Store new data back to file.
+		self.save_frame()
+
+
+	def fill_frame(self, state):
+		"""Fetch a matching word from the database for each slot left in a change frame.
+		The slots are moved to the frame's input list.
+		Arg:
+			state (ChangeFrame): the change frame to fill
+		"""
+		self.reseed(1)
+		change_frame = state.get_slots()
+		input_ = state.input
 		if not change_frame:
 			return
 
-		con = lite.connect(self.base + "dictionary.db")
-		cur = con.cursor()
-		with con: 
-			# Loop over change_frame and fetch a matching word from database to fill each slot.
-			for pidx, idx, tag in change_frame:
-				cur.execute("SELECT word, class FROM dictionary WHERE class = ? ORDER BY RANDOM() LIMIT 1", (tag,))
-				row = cur.fetchone()
-				new = row[0]
+		# Draw a matching word for each slot in change_frame in one go and add them to input_.
+		sampler = self.get_sampler()
+		with timer(self.stats, "db_sample"):
+			words = sampler.sample([tag for pidx, idx, tag in change_frame])
+		for (pidx, idx, tag), new in zip(change_frame, words):
+			input_.append( (pidx, idx, new) )
+		count(self.stats, "slots_db", len(words))
 
-				# Add new word to input_.
-				#print("replace:")
-				input_.append( (pidx, idx, new) )
+		# Empty change_frame.
+		state.clear_slots()
 
-		# Empty change_frame and store new data back to file.
-		template_data["change_frame"] = None
-		template_data["input"] = input_
-		with open(self.frame, "w") as f:
-			json.dump(template_data, f)
 
+	def connect(self):
+		"""Open a connection to dictionary.db, or return the already opened one.
+		Return:
+			a sqlite3 connection
+		"""
+		if self.con is None:
+			self.con = lite.connect(self.base + "dictionary.db")
+		return self.con
 
-	def compose_letter(self):
-		"""Joins template data from change_frame.json to create an html-tagged letter.
-		Created letter is saved as a .txt file.
+
+	def get_sampler(self):
+		"""Return a sampler for the database words, loading the words on first call.
+		Weighted sampling uses alias tables cached in dictionary.alias. Otherwise the compiled
+		dictionary.lex is mapped when it is not older than dictionary.db, see compile_dictionary().
 		Return:
-			the filepath to the generated file
+			a WeightedSampler, a lexicon.MappedLexicon or a WordSampler
 		"""
-		with open(self.frame, "r") as f:
-			template_data = json.load(f)
-			input_ = template_data["input"]
-			title = template_data["title"]
-			template = template_data["file"]
+		if self.sampler is None:
+			with timer(self.stats, "db_load"):
+				db = self.base + "dictionary.db"
+				lex = self.base + "dictionary.lex"
+				tables = None
+				if self.weighted:
+					tables = WeightedSampler.load(self.connect(), db, self.base + "dictionary.alias")
+					if tables is None:
+						print "dictionary.db has no frequency or rating column, drawing words uniformly"
+
+				if tables is not None:
+					self.sampler = WeightedSampler(tables, self.rng)
+				elif os.path.isfile(lex) and (not os.path.isfile(db) or os.path.getmtime(lex) >= os.path.getmtime(db)):
+					self.sampler = lexicon.MappedLexicon(lex, self.rng)
+				else:
+					self.sampler = WordSampler(self.connect(), self.rng)
+		return self.sampler
+
+
+	def compile_dictionary(self):
+		"""Compile the words of dictionary.db to the memory mapped dictionary.lex, see lexicon.py.
+		Return:
+			the number of words compiled
+		"""
+		return lexicon.compile_lexicon(self.base + "dictionary.db", self.base + "dictionary.lex", LetterRandomizer.TAGS)
 
-		# Open current change_frame, tokenize each paragraph and
-		# insert new words.
-		with codecs.open(template, encoding="utf8") as f:
-			text = f.read()
-		text = text.split("\n")
 
-		# Create a new letter by filling each paragraph,
-		# use nltk.word_tokenize() to get the correct indices of words to insert.
-		letter = []
-		for pidx, p in enumerate(text):
-			# Before tokenizing, check if the paragraph ends with two spaces to mark a line break for markdown,
-			# nltk.word_tokenize() will lose these.
-			linebreak = False
-			if p.endswith("  "):
-				linebreak = True
-			tokenized = LetterRandomizer.normalize_tokens(nltk.word_tokenize(p))
-			# Get new words belonging to this paragraph,
-			# guard against index error for mismatched paragraph indices.
-			try:
-				new = [ item for item in input_ if item[0] == pidx ]
-				for token in new:
-					tokenized[token[1]] = token[2]
+	def get_names(self):
+		"""Return a NameProvider for receivers and signatures, creating it on first call.
+		Return:
+			a NameProvider
+		"""
+		if self.names is None:
+			prefetch = self.name_prefetch if self.seed is None else 0
+			self.names = NameProvider(self.base + "names/names.json", LetterRandomizer.NAME_USAGE, prefetch, self.rng)
+		return self.names
 
-				# Add back the two spaces at the end of the paragraph.
-				joined = " ".join(tokenized)
-				if linebreak:
-					joined += "  "
 
-				letter.append(joined)
-			except IndexError as e:
-				print e
-				print "current file: ", template
-
-		# Join the paragraps together with newlines.
-		letter = "\n".join(letter)
-
-		# Define replacements for trimming whitespaces around punctuation and html tags.
-		# Use a list to keep the order intact when iterating.
-		replacements = [
-				(" ,", ","),
-				(" .", "."),
-				(" !", "!"),
-				(" ?", "?"),
-				(" :", ":"),
-				(" ;", ";"),
-				(" )", ")"),
-				("( ", "("),
-				("$ ", "$"),
-				(" @ ", "@"),
-				("# #", "##"),
-				("< span class='' receiver'' >", "<span class=\"receiver\">"), # normalize_tokens() will left shift the 's
-				("< span class='' receiver first'' >", "<span class=\"receiver first\">"),
-				("< span class='' signature'' >", "<span class=\"signature\">"),
-				("< span class='' signature first'' >", "<span class=\"signature first\">"),
-				(" < /span >", "</span>"),
-				(" '", "'")
-			]
-		for token in replacements:
-			letter = letter.replace(token[0], token[1])
+	def reseed(self, stage):
+		"""With a seed, restart the random choices of a stage from the seed and the stage
+		number. Each stage then makes the same choices whether or not the earlier stages
+		ran in the same process, eg. when a letter is initialized and filled by separate runs.
+		Arg:
+			stage (int): 0 for selecting words to change, 1 for filling them, 2 for names
+		"""
+		if self.seed is not None:
+			# Hashing a tuple gives different values on 32 and 64 bit builds, derive the seed from an md5 instead.
+			digest = hashlib.md5("{}:{}".format(self.seed, stage)).hexdigest()
+			self.set_rng(random.Random(int(digest, 16)))
 
-		# Process to html via markdown and remove extra newline characters between paragraphs.
-		letter = markdown.markdown(letter)
-		letter = letter.replace("\n", "")
 
-		# Finally, using beautifulsoup, check if a receiver name or a signature should be added:
-		soup = bs4.BeautifulSoup(letter, "lxml")
-		receiver = soup.select("span.receiver")
-		# Receiver.
-		for tag in receiver:
-			if "first" in tag["class"]:
-				tag.string = LetterRandomizer.generate_name(first_only=True)
-			else:
-				tag.string = LetterRandomizer.generate_name(last_only=False)
+	def set_rng(self, rng):
+		"""Use rng for all random choices of the randomizer, its WordSampler and NameProvider.
+		Arg:
+			rng (random.Random): the new source of random choices, or the random module
+		"""
+		self.rng = rng
+		if self.sampler is not None:
+			self.sampler.rng = rng
+		if self.names is not None:
+			self.names.rng = rng
+
+
+	def get_tagger(self):
+		"""Return the nltk perceptron tagger, cached in tagger.pickle for faster loading.
+		Return:
+			an nltk.tag.PerceptronTagger
+		"""
+		with timer(self.stats, "tagger_load"):
+			return get_tagger(self.base + "tagger.pickle")
 
-		# Signatures, usually full name.
-		signature = soup.select("span.signature")
-		for tag in signature:
-			if "first" in tag["class"]:
-				tag.string = LetterRandomizer.generate_name(first_only=True)
-			else:
-				tag.string = LetterRandomizer.generate_name()
 
+	def get_input_tagger(self):
+		"""Return a LookupTagger for user input, reading its lexicon on first call. The lexicon
+		is cached in dictionary.tags, see LookupTagger.load().
+		Return:
+			a LookupTagger
+		"""
+		if self.input_tagger is None:
+			with timer(self.stats, "tagger_load"):
+				try:
+					lexicon = LookupTagger.load(self.connect(), self.base + "dictionary.db", self.base + "dictionary.tags")
+				except (lite.Error, OSError):
+					lexicon = {}
+			self.input_tagger = LookupTagger(self.get_tagger, lexicon, stats=self.stats)
+		return self.input_tagger
 
-		# Get the contents of soup.body as a string.
-		contents = soup.body.contents
-		letter = "".join([unicode(p) for p in contents])  # elements of contents are BeautifulSoup Tags, cast to unicode
 
+	def compose_letter(self):
+		"""Joins template data from change_frame.json to create an html-tagged letter.
+		Created letter is passed to the output sink, by default saved as a .txt file.
+		Return:
+			the value returned by the sink, for the default sink the filepath to the generated file
+		"""
+		state = self.get_frame()
+		letter = self.render_letter(state)
+		count(self.stats, "letters")
+		with timer(self.stats, "file_io"):
+			return self.sink.write(state.title, letter)
 
-		# Generate a filename with a timestamp
-		timestamp = time.strftime("%d.%m.%y")
-		timestamp = timestamp.replace(".", "_")
-		title = title.replace(" ", "_")
-		fname = title + "_" + timestamp + ".txt"
-		path = self.wd + fname
-		with codecs.open(path, "w", encoding="utf8") as f:
-			f.write(letter)
 
-		return path
+	def render_letter(self, state):
+		"""Create an html-tagged letter from a change frame. The template is run through
+		markdown once and cached as a skeleton, see SkeletonCache. The new words and names
+		are substituted into the skeleton.
+		Arg:
+			state (ChangeFrame): a filled change frame
+		Return:
+			the letter as an html string
+		"""
+		self.reseed(2)
+		template = state.file
+
+		# Map the positions of the new words to the words.
+		new = dict(((pidx, idx), word) for pidx, idx, word in state.input)
+
+		entry = self.index.get(template)
+		skeleton = self.skeletons.get(template, entry)
+		letter = []
+		for i, chunk in enumerate(skeleton):
+			# Every other chunk is a slot: a word to change or keep, or a name placeholder.
+			if not i % 2:
+				letter.append(chunk)
+			elif isinstance(chunk, basestring):
+				letter.append(self.fill_placeholder(chunk))
+			else:
+				pidx, idx, original = chunk
+				word = new.get((pidx, idx))
+				letter.append(original if word is None else cgi.escape(word))
+
+		return "".join(letter)
+
+
+	def fill_placeholder(self, cls):
+		"""Create a receiver or signature span with a random name.
+		Arg:
+			cls (string): class attribute of the placeholder span, eg. "receiver first"
+		Return:
+			the html-tagged name
+		"""
+		# Use only the first name if requested, otherwise a full name.
+		with timer(self.stats, "names"):
+			if "first" in cls.split():
+				name = self.get_names().generate(first_only=True)
+			else:
+				name = self.get_names().generate()
+		return u"<span class=\"{0}\">{1}</span>".format(cls, cgi.escape(name))
 
 
 	def randomize_letter(self):
 		"""Generate a randomized letter by selecting a random template and
 		processing with fill_missing.
 		Return:
-			a tuple of the title of the letter and its filepath
+			a tuple of the title of the letter and the value returned by the sink
 		"""
-		files = glob.glob(self.base + "templates/*.txt")
-		letter = random.choice(files)
+		self.reseed(0)
+		letter = self.catalog.pick(self.rng)
 		print "Generating a letter from", letter
 		title = self.parse_letter(letter)
 		self.fill_missing()
@@ -378,20 +491,132 @@ class LetterRandomizer():
 		return title, path
 
 
+	def generate_batch(self, n, templates=None, workers=1):
+		"""Generate a batch of randomized letters in memory, without going through change_frame.json.
+		With more than one worker the letters are generated in a pool of processes, each
+		keeping its own nltk tagger and database connection. With a seed each letter gets
+		its own seed drawn from it, so the batch is the same for any number of workers.
+		Args:
+			n (int): number of letters to generate
+			templates (list): paths to the templates to choose from, defaults to all templates
+			workers (int): number of worker processes
+		Return:
+			a list of (title, letter) tuples
+		"""
+		if templates is None:
+			templates = self.catalog.templates()
+		templates = sorted(templates)
+
+		# Make sure the index is up to date before forking to keep the workers from rebuilding it.
+		self.index.build(templates)
+		if self.seed is None:
+			jobs = [(random.choice(templates), None) for i in range(n)]
+		else:
+			rng = random.Random(self.seed)
+			jobs = [(rng.choice(templates), rng.getrandbits(32)) for i in range(n)]
+
+		if workers <= 1:
+			return [self.generate(template, seed) for template, seed in jobs]
+
+		import multiprocessing
+		pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(self.base, self.wd_name, self.weighted))
+		try:
+			letters = pool.map(generate_worker, jobs, chunksize=max(1, n // (workers * 4)))
+		finally:
+			pool.close()
+			pool.join()
+
+		return letters
+
+
+	def generate(self, template, seed = None):
+		"""Generate a single letter from a template with words from the database.
+		Args:
+			template (string): path to the template file
+			seed (int): seed for this letter instead of the seed of the randomizer
+		Return:
+			a (title, letter) tuple
+		"""
+		previous = self.seed
+		if seed is not None:
+			self.seed = seed
+		try:
+			state = self.make_frame(template)
+			self.fill_frame(state)
+			return state.title, self.render_letter(state)
+		finally:
+			if previous is None and seed is not None:
+				self.set_rng(random)
+			self.seed = previous
+
+
 	#==================================================================================
 	# Helper functions =
 	#===================
 
+	def get_frame(self):
+		"""Return the current change frame, reading it from change_frame.json if not yet in memory.
+		A session's frame is read from the session store on every call, since other processes
+		may have changed it since.
+		Return:
+			a ChangeFrame
+		"""
+		if self.session is not None:
+			with timer(self.stats, "file_io"):
+				self.state = ChangeFrame.from_dict(self.get_store().load(self.session))
+		elif self.state is None:
+			with timer(self.stats, "file_io"):
+				self.state = ChangeFrame.load(self.frame)
+		return self.state
+
+
+	def save_frame(self, new=False):
+		"""Checkpoint the current change frame to change_frame.json or the session store.
+		Arg:
+			new (boolean): whether the frame is for a new letter, replacing the session's previous letter
+		"""
+		with timer(self.stats, "file_io"):
+			if self.session is None:
+				self.state.save(self.frame)
+			else:
+				store = self.get_store()
+				if new:
+					store.create(self.session, self.state)
+				else:
+					store.save(self.session, self.state)
+				# Words entered by another process in the meantime win over ours.
+				self.state = ChangeFrame.from_dict(store.load(self.session))
+
+
+	def get_store(self):
+		"""Return the SessionStore of the working directory, opening it on first call.
+		Return:
+			a sessions.SessionStore
+		"""
+		if self.store is None:
+			self.store = sessions.SessionStore(self.wd + "sessions.db")
+		return self.store
+
+
+	def use_session(self, session):
+		"""Switch to working on another letter.
+		Arg:
+			session (string): ID of the letter in the session store, None for change_frame.json
+		"""
+		if session != self.session:
+			self.session = session
+			self.state = None
+
+
 	def show_files(self):
 		"""Show contents of template.json."""
-		with open(self.frame, "r") as f:
-			template_data = json.load(f)  
+		state = self.get_frame()
 
 		print "input:"
-		pprint.pprint(template_data["input"])
+		pprint.pprint(state.input)
 
 		print "change_frame:"
-		pprint.pprint(template_data["change_frame"])
+		pprint.pprint(state.get_slots())
 
 
 	def get_template_status(self):
@@ -399,19 +624,15 @@ class LetterRandomizer():
 		Return:
 			a string describing how many adjectives, nouns, verbs and adverbs are needed
 		"""
-		with open(self.frame, "r") as f:
-			template_data = json.load(f)
-			change_frame = template_data["change_frame"]
+		state = self.get_frame()
 
 		# no more words needed, return an empty string
-		if not change_frame:
+		if not state.has_slots():
 			return ""
 
 		# create a dict to map tags to number of matching words needed
-		tags = [token[2] for token in change_frame]
 		d = dict.fromkeys(LetterRandomizer.TAGS, 0)
-		for tag in tags:
-			d[tag] = tags.count(tag)
+		d.update(state.count_slots())
 
 		# new dict for printing grouped data
 		d_h = dict()
@@ -442,6 +663,7 @@ class LetterRandomizer():
 	@staticmethod
 	def generate_name(nfirst_names = 1, first_only=False, last_only=False):
 		"""Use requests on http://www.behindthename.com/random/ to generate a name.
+		Letters use the local names of NameProvider, this is the optional remote source.
 		Args:
 			nfirst_names (int): number first names the result should have
 			first_only (boolean): whether only the first name should be returned
@@ -449,40 +671,41 @@ class LetterRandomizer():
 		Return:
 			the generated name
 		"""
+		names = LetterRandomizer.fetch_names(nfirst_names)
+		if first_only:
+			return names[0]
+		if last_only:
+			return names[-1]
+		return " ".join(names)
+
 
+	@staticmethod
+	def fetch_names(nfirst_names = 1):
+		"""Fetch a random name from http://www.behindthename.com/random/.
+		Arg:
+			nfirst_names (int): number first names the result should have
+		Return:
+			a list of the first names followed by the surname
+		"""
 		# S.et name parameters,
 		# first + middle + surname.
 		name_params = {
 			"number":nfirst_names,
 			"gender":"both",
 			"randomsurname":"yes",
-			"all":"no",
-			"usage_chi":1,
-			"usage_dan":1,
-			"usage_dut":1,
-			"usage_end":1,
-			"usage_est":1,
-			"usage_get":1,
-			"usage_hun":1,
-			"usage_ind":1,
-			"usage_ita":1,
-			"usage_jew":1,
-			"usage_nor":1,
-			"usage_per":1,
-			"usage_rus":1,
-			"usage_spa":1
+			"all":"no"
 		}
-		r = requests.get("http://www.behindthename.com/random/random.php", params=name_params)
+		for usage in LetterRandomizer.NAME_USAGE:
+			name_params["usage_" + usage] = 1
+
+		import requests
+		import bs4
+		r = requests.get("http://www.behindthename.com/random/random.php", params=name_params, timeout=10)
 
 		soup = bs4.BeautifulSoup(r.text, "lxml")
 
 		# Get the text value of each <a> element having class "plain".
-		names = [a.text for a in soup.find_all("a", class_="plain")]
-		if first_only:
-			return names[0]
-		if last_only:
-			return names[-1]
-		return " ".join(names)
+		return [a.text for a in soup.find_all("a", class_="plain")]
 
 
 	@staticmethod
@@ -510,39 +733,1270 @@ class LetterRandomizer():
 
 
 
+class Stats():
+	"""Timings and counters of the stages of generating letters. Pass one to LetterRandomizer
+	to collect them. Each timing can also be passed to a callback and logged as a
+	structured record of the "letters" logger with stage and seconds attributes.
+
+	Timed stages: tokenize, tag, db_load, db_sample, names, markdown and file_io.
+	Counters: slots_input (slots filled from user input), slots_db (slots filled from
+	the database) and letters (letters composed).
+	"""
+
+	def __init__(self, callback = None, log = False):
+		"""Args:
+			callback (function): called with (stage, seconds) after each timed stage
+			log (boolean): whether to log each timing
+		"""
+		self.callback = callback
+		self.logger = logging.getLogger("letters") if log else None
+		self.timings = {}  # stage: [calls, total seconds, max seconds]
+		self.counters = {}
+
+
+	def record(self, stage, seconds):
+		"""Add a timing of a stage."""
+		timing = self.timings.setdefault(stage, [0, 0.0, 0.0])
+		timing[0] += 1
+		timing[1] += seconds
+		timing[2] = max(timing[2], seconds)
+
+		if self.callback:
+			self.callback(stage, seconds)
+		if self.logger:
+			self.logger.info("%s took %.2f ms", stage, seconds * 1000, extra={"stage":stage, "seconds":seconds})
+
+
+	def count(self, counter, n = 1):
+		"""Increment a counter."""
+		self.counters[counter] = self.counters.get(counter, 0) + n
+
+
+	def summary(self):
+		"""Return:
+			a dict of {timings, counters} where timings maps each stage to {calls, total, max}
+			in seconds
+		"""
+		timings = dict((stage, {"calls":t[0], "total":t[1], "max":t[2]}) for stage, t in self.timings.items())
+		return {"timings":timings, "counters":dict(self.counters)}
+
+
+	def reset(self):
+		"""Clear all timings and counters."""
+		self.timings = {}
+		self.counters = {}
+
+
+
+@contextlib.contextmanager
+def timer(stats, stage):
+	"""Time the enclosed block as a stage, does nothing if stats is None."""
+	if stats is None:
+		yield
+		return
+	start = time.time()
+	try:
+		yield
+	finally:
+		stats.record(stage, time.time() - start)
+
+
+def count(stats, counter, n = 1):
+	"""Increment a counter of stats if it is not None."""
+	if stats is not None:
+		stats.count(counter, n)
+
+
+
+class ChangeFrame():
+	"""The letter currently being processed: the template, the slots still
+	waiting for a word and the words entered so far. Kept in memory between calls
+	and stored to file only at explicit checkpoints, see LetterRandomizer.save_frame().
+
+	Open slots are kept in a queue per nltk tag so a word can be matched to a slot
+	without scanning the whole frame. Each slot remembers its position in the
+	original change_frame list, which is restored when the frame is stored.
+	"""
+
+	def __init__(self, title, template, change_frame, input_):
+		"""Args:
+			title (string): title of the letter
+			template (string): path to the template file
+			change_frame (list): (paragraph_idx, word_idx, nltk_tag) tuples of words to change,
+				None once filled from the database
+			input_ (list): (paragraph_idx, word_idx, word) tuples of new words
+		"""
+		self.title = title
+		self.file = template
+		self.input = input_
+		self.slots = None  # nltk tag: list of (position, slot) tuples
+		if change_frame is not None:
+			self.slots = {}
+			for position, slot in enumerate(change_frame):
+				self.slots.setdefault(slot[2], []).append((position, slot))
+
+
+	def take(self, tag):
+		"""Remove the latest open slot with a given tag.
+		Arg:
+			tag (string): nltk tag
+		Return:
+			the (paragraph_idx, word_idx, nltk_tag) slot, or None if there are no open slots with the tag
+		"""
+		if self.slots:
+			queue = self.slots.get(tag)
+			if queue:
+				return queue.pop()[1]
+		return None
+
+
+	def has_slots(self):
+		"""Return:
+			True if there are open slots left
+		"""
+		return bool(self.slots) and any(self.slots.values())
+
+
+	def get_slots(self):
+		"""Return:
+			a list of the open slots in their original order, or None once filled from the database
+		"""
+		if self.slots is None:
+			return None
+		return [slot for position, slot in sorted(item for queue in self.slots.values() for item in queue)]
+
+
+	def count_slots(self):
+		"""Return:
+			a dict mapping nltk tags to the number of open slots
+		"""
+		return dict((tag, len(queue)) for tag, queue in (self.slots or {}).items())
+
+
+	def clear_slots(self):
+		"""Mark the frame as filled from the database."""
+		self.slots = None
+
+
+	@staticmethod
+	def load(path):
+		"""Read a change frame from a json file.
+		Arg:
+			path (string): path to the file
+		Return:
+			a ChangeFrame
+		"""
+		with open(path) as f:
+			return ChangeFrame.from_dict(json.load(f))
+
+
+	@staticmethod
+	def from_dict(d):
+		"""Create a change frame from a dict of {title, file, change_frame, input}."""
+		return ChangeFrame(d["title"], d["file"], d["change_frame"], d["input"])
+
+
+	def to_dict(self):
+		"""Return:
+			the change frame as a dict of {title, file, change_frame, input}
+		"""
+		return {"title":self.title, "file":self.file, "change_frame":self.get_slots(), "input":self.input}
+
+
+	def save(self, path):
+		"""Store the change frame as json. The data is first written to a temporary
+		file which is then renamed over the old one, so a crash never leaves a half
+		written file behind.
+		Arg:
+			path (string): path to the file
+		"""
+		tmp = path + ".tmp"
+		with open(tmp, "w") as f:
+			json.dump(self.to_dict(), f)
+			f.flush()
+			os.fsync(f.fileno())
+		os.rename(tmp, path)
+
+
+
+class WordSampler():
+	"""Draws random words of a given nltk tag from the database. The words of all valid
+	tags are read once and grouped by tag, so filling a letter costs a list lookup
+	per slot rather than an ORDER BY RANDOM() query.
+	"""
+
+	def __init__(self, con, rng = random):
+		"""Read the words from the database.
+		Args:
+			con (sqlite3.Connection): connection to dictionary.db
+			rng (random.Random): source of random choices, defaults to the random module
+		"""
+		self.rng = rng
+		self.words = {}
+		cur = con.cursor()
+		placeholders = ", ".join(["?"] * len(LetterRandomizer.TAGS))
+		cur.execute("SELECT word, class FROM dictionary WHERE class IN (" + placeholders + ")", LetterRandomizer.TAGS)
+		for word, tag in cur:
+			self.words.setdefault(tag, []).append(word)
+
+
+	def sample(self, tags):
+		"""Draw a random word for each tag.
+		Arg:
+			tags (list): nltk tags of the words to draw
+		Return:
+			a list of words in the same order as tags
+		"""
+		return [self.rng.choice(self.words[tag]) for tag in tags]
+
+
+
+class WeightedSampler():
+	"""Draws random words of a given nltk tag weighted by a frequency or rating column of the
+	database. The weights of each tag are turned into an alias table (Vose's method), so a
+	draw costs two random numbers regardless of the number of words. The tables are cached
+	to a file and rebuilt when dictionary.db changes.
+	"""
+
+	# Columns to weight words by, in order of preference.
+	WEIGHT_COLUMNS = ("frequency", "freq", "count", "rating")
+
+	def __init__(self, tables, rng = random):
+		"""Args:
+			tables (dict): nltk tags mapped to (words, probabilities, aliases) tuples, see build()
+			rng (random.Random): source of random choices, defaults to the random module
+		"""
+		self.tables = tables
+		self.rng = rng
+
+
+	@staticmethod
+	def column(con):
+		"""Find the column to weight words by.
+		Arg:
+			con (sqlite3.Connection): connection to dictionary.db
+		Return:
+			name of the column, or None if the dictionary table has none of WEIGHT_COLUMNS
+		"""
+		columns = [row[1].lower() for row in con.execute("PRAGMA table_info(dictionary)")]
+		for column in WeightedSampler.WEIGHT_COLUMNS:
+			if column in columns:
+				return column
+		return None
+
+
+	@staticmethod
+	def load(con, db, cache = None):
+		"""Read the alias tables from the cache, or build them if the cache is missing or
+		older than the database.
+		Args:
+			con (sqlite3.Connection): connection to dictionary.db
+			db (string): path to dictionary.db
+			cache (string): path to the cache file, None to not use a cache
+		Return:
+			the alias tables, see build(), or None if the database has no weight column
+		"""
+		st = os.stat(db)
+		key = (st.st_mtime, st.st_size)
+		if cache and os.path.isfile(cache):
+			try:
+				with open(cache, "rb") as f:
+					cached_key, tables = cPickle.load(f)
+				if cached_key == key:
+					return tables
+			except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+				pass
+
+		column = WeightedSampler.column(con)
+		if column is None:
+			return None
+
+		tables = WeightedSampler.build(con, column)
+		if cache:
+			try:
+				with open(cache, "wb") as f:
+					cPickle.dump((key, tables), f, cPickle.HIGHEST_PROTOCOL)
+			except IOError:
+				pass
+		return tables
+
+
+	@staticmethod
+	def build(con, column):
+		"""Build an alias table for the words of each valid tag.
+		Args:
+			con (sqlite3.Connection): connection to dictionary.db
+			column (string): the column to weight words by
+		Return:
+			a dict of nltk tags mapped to (words, probabilities, aliases) tuples
+		"""
+		words = {}
+		weights = {}
+		placeholders = ", ".join(["?"] * len(LetterRandomizer.TAGS))
+		cur = con.execute("SELECT word, class, " + column + " FROM dictionary WHERE class IN (" + placeholders + ")", LetterRandomizer.TAGS)
+		for word, tag, weight in cur:
+			words.setdefault(tag, []).append(word)
+			weights.setdefault(tag, []).append(max(weight or 0, 0))
+
+		return dict((tag, (words[tag],) + WeightedSampler.alias_table(weights[tag])) for tag in words)
+
+
+	@staticmethod
+	def alias_table(weights):
+		"""Create an alias table with Vose's method.
+		Arg:
+			weights (list): non-negative weights, all words are equally likely if they sum to 0
+		Return:
+			a tuple of lists of probabilities and aliases: item i is drawn by picking a uniform
+			random index i and keeping it with probability[i], otherwise taking alias[i]
+		"""
+		n = len(weights)
+		total = float(sum(weights))
+		if not total:
+			weights = [1] * n
+			total = float(n)
+
+		scaled = [w * n / total for w in weights]
+		probabilities = [1.0] * n
+		aliases = range(n)
+		small = [i for i, p in enumerate(scaled) if p < 1]
+		large = [i for i, p in enumerate(scaled) if p >= 1]
+		while small and large:
+			s = small.pop()
+			l = large.pop()
+			probabilities[s] = scaled[s]
+			aliases[s] = l
+			scaled[l] += scaled[s] - 1
+			if scaled[l] < 1:
+				small.append(l)
+			else:
+				large.append(l)
+
+		return probabilities, aliases
+
+
+	def sample(self, tags):
+		"""Draw a weighted random word for each tag.
+		Arg:
+			tags (list): nltk tags of the words to draw
+		Return:
+			a list of words in the same order as tags
+		"""
+		sample = []
+		for tag in tags:
+			words, probabilities, aliases = self.tables[tag]
+			i = int(self.rng.random() * len(words))
+			if self.rng.random() >= probabilities[i]:
+				i = aliases[i]
+			sample.append(words[i])
+		return sample
+
+
+
+class NameProvider():
+	"""Generates random names from the local name lists in names/names.json. Each name is
+	drawn from a usage region chosen by weight. Optionally a background thread keeps a
+	bounded pool of names fetched from behindthename.com, which are used while available.
+	Generating a name never waits for the network.
+	"""
+
+	def __init__(self, path, usage, prefetch = 0, rng = random):
+		"""Read the name lists and start the prefetch thread.
+		Args:
+			path (string): path to names.json
+			usage (dict): usage regions mapped to their relative weights
+			prefetch (int): size of the pool of remote names, 0 to disable
+			rng (random.Random): source of random choices, defaults to the random module
+		"""
+		self.rng = rng
+		with codecs.open(path, encoding="utf8") as f:
+			names = json.load(f)
+
+		self.regions = [region for region in sorted(usage) if usage[region] > 0 and region in names]
+		self.names = names
+		self.cumulative = []
+		total = 0
+		for region in self.regions:
+			total += usage[region]
+			self.cumulative.append(total)
+
+		self.pool = None
+		if prefetch > 0:
+			self.pool = Queue.Queue(prefetch)
+			thread = threading.Thread(target=self.prefetch)
+			thread.daemon = True
+			thread.start()
+
+
+	def generate(self, nfirst_names = 1, first_only=False, last_only=False):
+		"""Generate a name, see LetterRandomizer.generate_name().
+		Args:
+			nfirst_names (int): number first names the result should have
+			first_only (boolean): whether only the first name should be returned
+			last_only (boolean): whether only the last name should be returned
+		Return:
+			the generated name
+		"""
+		names = None
+		if self.pool is not None and nfirst_names == 1:
+			try:
+				names = self.pool.get_nowait()
+			except Queue.Empty:
+				pass
+
+		if not names:
+			names = self.local(nfirst_names)
+
+		if first_only:
+			return names[0]
+		if last_only:
+			return names[-1]
+		return " ".join(names)
+
+
+	def local(self, nfirst_names = 1):
+		"""Draw a name from the local name lists.
+		Arg:
+			nfirst_names (int): number first names the result should have
+		Return:
+			a list of the first names followed by the surname
+		"""
+		x = self.rng.random() * self.cumulative[-1]
+		region = self.names[self.regions[bisect.bisect(self.cumulative, x)]]
+		first = [self.rng.choice(region["first"]) for i in range(nfirst_names)]
+		return first + [self.rng.choice(region["last"])]
+
+
+	def prefetch(self):
+		"""Keep the pool of remote names full. Run in a background thread,
+		backs off for a while whenever the remote source fails.
+		"""
+		import requests
+		delay = 1
+		while True:
+			try:
+				names = LetterRandomizer.fetch_names()
+			except requests.RequestException:
+				names = None
+
+			if not names:
+				time.sleep(delay)
+				delay = min(delay * 2, 300)
+				continue
+
+			delay = 1
+			self.pool.put(names)  # blocks while the pool is full
+
+
+
+class TemplateIndex():
+	"""A precompiled index of tokenized and tagged letter templates. Each template is tokenized
+	and tagged once and the result is stored to a file of its own in the index folder, so
+	generating a letter reads only the entry of its template and does not need to run the
+	nltk tagger. An entry is rebuilt whenever its template file changes.
+	"""
+
+	# Define characters for words that should be ignored when determining nltk tags,
+	# most of these shouldn't receive a valid tag anyway.
+	INVALID_TOKENS = (
+		"<",
+		">",
+		"span",
+		"class",
+		"id",
+		"signature",
+		"receiver",
+		"/",
+		"#",
+		"@",
+		"`",
+		"'"
+	)
+
+	# Format version of the index files, entries of an other version are rebuilt.
+	VERSION = 5
+
+	# Receiver and signature placeholders to fill with names. Also matches spans with
+	# a sample name, the misspelled <span class="signature></span> and a placeholder
+	# closed with <span> instead of </span>.
+	PLACEHOLDER = re.compile(r"""<span class=["']?((?:receiver|signature)[^"'>]*)["']?>[^<]*</?span>""")
+
+	def __init__(self, path, stats = None, tagger_cache = None):
+		"""Define path to the index folder. Entries are read lazily on first access.
+		Args:
+			path (string): path to the index folder
+			stats (Stats): collects tokenizing and tagging times, None to disable
+			tagger_cache (string): path to the tagger cache, see get_tagger()
+		"""
+		self.path = path
+		self.stats = stats
+		self.tagger_cache = tagger_cache
+		self.entries = {}  # entries read or built in this process, by absolute path of the template
+		# The bot prepares the next template in a thread while the current one is processed.
+		self.lock = threading.RLock()
+
+
+	def filename(self, key):
+		"""Return:
+			path to the index file of a template, named by the hash of the template's absolute path
+		"""
+		if isinstance(key, unicode):
+			key = key.encode("utf8")
+		return self.path + hashlib.md5(key).hexdigest() + ".json"
+
+
+	def load(self, key):
+		"""Read the entry of a template from its index file.
+		Arg:
+			key (string): absolute path to the template file
+		Return:
+			the entry, or None if the template isn't indexed or its file is of an other version
+		"""
+		try:
+			with open(self.filename(key)) as f:
+				d = json.load(f)
+			if d.get("version") == TemplateIndex.VERSION and d.get("template") == key:
+				return d["entry"]
+		except (IOError, ValueError, AttributeError, KeyError):
+			pass
+		return None
+
+
+	def save(self, template):
+		"""Store the entry of a template to its index file. The entry is written to a temporary
+		file of this process which is then renamed over the old one, so readers never see a half
+		written entry.
+		Arg:
+			template (string): path to the template file
+		"""
+		with self.lock:
+			key = os.path.abspath(template)
+			path = self.filename(key)
+			tmp = "{}.{}.tmp".format(path, os.getpid())
+			with timer(self.stats, "file_io"):
+				if not os.path.isdir(self.path):
+					os.makedirs(self.path)
+				with open(tmp, "w") as f:
+					json.dump({"version":TemplateIndex.VERSION, "template":key, "entry":self.entries[key]}, f)
+					f.flush()
+					os.fsync(f.fileno())
+				os.rename(tmp, path)
+
+
+	def lookup(self, template):
+		"""Fetch the index entry for a template as is, without building it.
+		Arg:
+			template (string): path to the template file
+		Return:
+			the index entry for the template, or None if the template isn't indexed
+		"""
+		with self.lock:
+			key = os.path.abspath(template)
+			entry = self.entries.get(key)
+			if entry is None:
+				with timer(self.stats, "file_io"):
+					entry = self.load(key)
+				if entry is not None:
+					self.entries[key] = entry
+			return entry
+
+
+	def get(self, template):
+		"""Fetch the index entry for a template, building it first if it is missing or stale.
+		Arg:
+			template (string): path to the template file
+		Return:
+			the index entry for the template, a dict of {mtime, hash, paragraphs}
+		"""
+		with self.lock:
+			if self.refresh(template):
+				self.save(template)
+			return self.entries[os.path.abspath(template)]
+
+
+	def build(self, templates):
+		"""Ensure all templates are indexed and store the changed entries.
+		Arg:
+			templates (list): paths to the template files
+		Return:
+			the number of templates that were (re)tokenized
+		"""
+		with self.lock:
+			updated = 0
+			for template in templates:
+				if self.refresh(template):
+					self.save(template)
+					updated += 1
+			return updated
+
+
+	def refresh(self, template):
+		"""Check whether the index entry for a template is up to date and rebuild it if not.
+		A changed modification time alone only causes the file to be hashed, the template
+		is tagged again only if its contents have changed.
+		Arg:
+			template (string): path to the template file
+		Return:
+			True if the index was modified
+		"""
+		with self.lock:
+			key = os.path.abspath(template)
+			mtime = os.path.getmtime(template)
+			entry = self.lookup(template)
+			if entry and entry["mtime"] == mtime:
+				return False
+
+			with codecs.open(template, encoding="utf8") as f:
+				text = f.read()
+			digest = hashlib.md5(text.encode("utf8")).hexdigest()
+			if entry and entry["hash"] == digest:
+				entry["mtime"] = mtime
+				return True
+
+			self.entries[key] = {"mtime":mtime, "hash":digest, "paragraphs":TemplateIndex.tokenize(text, get_tagger(self.tagger_cache), self.stats)}
+			return True
+
+
+	@staticmethod
+	def tokenize(text, tagger, stats = None):
+		"""Tokenize and tag a template.
+		Args:
+			text (string): contents of a markdown encoded template
+			tagger (nltk.tag.PerceptronTagger): the tagger to use
+			stats (Stats): collects tokenizing and tagging times, None to disable
+		Return:
+			a list of paragraphs as {text, spans, slots, names} dicts, where spans lists the
+			character offsets of each token in text, slots maps nltk tags to indices
+			of tokens that can be changed and names lists the offsets and classes of
+			receiver and signature placeholders
+		"""
+		import nltk
+
+		# nltk.word_tokenze() ignores newline characters. To keep track of paragraphs,
+		# split text by newlines.
+		paragraphs = []
+		for p in text.split("\n"):
+			with timer(stats, "tokenize"):
+				tokens = LetterRandomizer.normalize_tokens(nltk.word_tokenize(p))
+			with timer(stats, "tag"):
+				tagged = tagger.tag(tokens)
+			spans = TemplateIndex.align(p, tokens)
+			names = [[m.start(), m.end(), m.group(1)] for m in TemplateIndex.PLACEHOLDER.finditer(p)]
+
+			slots = {}
+			for idx, token in enumerate(tagged):
+				if token[1] in LetterRandomizer.TAGS and spans[idx] and not any(item in token[0] for item in TemplateIndex.INVALID_TOKENS):
+					# Skip words inside placeholders.
+					if any(start < spans[idx][1] and spans[idx][0] < end for start, end, cls in names):
+						continue
+					slots.setdefault(token[1], []).append(idx)
+
+			paragraphs.append({"text":p, "spans":spans, "slots":slots, "names":names})
+
+		return paragraphs
+
+
+	@staticmethod
+	def align(text, tokens):
+		"""Find the character offsets of tokens in the text they were tokenized from.
+		nltk.word_tokenize() converts double quotes to `` and '', these are matched
+		against the original quotes.
+		Args:
+			text (string): the tokenized text
+			tokens (list): the tokens
+		Return:
+			a list of [start, end] offsets for each token, or None for tokens not found
+		"""
+		spans = []
+		cursor = 0
+		for token in tokens:
+			for form in (token, token.replace("``", '"').replace("''", '"')):
+				start = text.find(form, cursor)
+				if start != -1:
+					break
+
+			if start == -1:
+				spans.append(None)
+				continue
+
+			cursor = start + len(form)
+			spans.append([start, cursor])
+
+		return spans
+
+
+
+class TemplateCatalog():
+	"""An indexed catalog of the templates in a folder, stored in a SQLite database. Lists,
+	picks and titles templates without globbing the folder or reading templates/summary.json.
+	For each template the catalog keeps its title, size, modification time, content hash and,
+	once the template is in the TemplateIndex, its number of paragraphs and slots per tag.
+
+	The catalog is refreshed on first use in each process if the folder or summary.json has
+	changed since, only changed templates are read again. Editing a template in place doesn't
+	change the folder, such a template is updated when it is next used, see check(), or by a
+	full refresh. The template itself is always read through the TemplateIndex, which notices
+	the edit on its own.
+
+	Templates are numbered 1..n with no gaps, so a random template is picked by its number.
+	"""
+
+	def __init__(self, path, directory, index, stats = None):
+		"""Args:
+			path (string): path to the catalog database
+			directory (string): path to the template folder
+			index (TemplateIndex): index to read paragraph and slot counts from
+			stats (Stats): collects refresh times, None to disable
+		"""
+		self.path = path
+		self.directory = directory
+		self.index = index
+		self.stats = stats
+		self.con = None
+		self.checked = False
+		self.lock = threading.RLock()  # see TemplateIndex
+
+
+	def connect(self):
+		"""Open the catalog, creating the tables if needed, or return the already opened connection.
+		Return:
+			a sqlite3 connection
+		"""
+		if self.con is None:
+			folder = os.path.dirname(self.path)
+			if folder and not os.path.isdir(folder):
+				os.makedirs(folder)
+			# letterd.py uses the catalog from several threads one at a time.
+			self.con = lite.connect(self.path, check_same_thread=False)
+			with self.con:
+				self.con.execute("CREATE TABLE IF NOT EXISTS templates (id INTEGER PRIMARY KEY, name TEXT UNIQUE, title TEXT, size INTEGER, mtime REAL, hash TEXT, paragraphs INTEGER)")
+				self.con.execute("CREATE TABLE IF NOT EXISTS slots (name TEXT, tag TEXT, n INTEGER, PRIMARY KEY (name, tag))")
+				self.con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)")
+		return self.con
+
+
+	def refresh(self, full = False):
+		"""Bring the catalog up to date with the template folder. Without full, nothing is done
+		unless the modification time of the folder or summary.json has changed.
+		Arg:
+			full (boolean): whether to check every template for changes and read the paragraph
+				and slot counts of templates indexed since they were cataloged
+		Return:
+			the number of templates added or updated
+		"""
+		with self.lock:
+			self.checked = True
+			con = self.connect()
+			summary = self.directory + "summary.json"
+			mtimes = {"directory":os.path.getmtime(self.directory), "summary":os.path.getmtime(summary) if os.path.isfile(summary) else 0}
+			meta = dict(con.execute("SELECT key, value FROM meta"))
+			if not full and all(meta.get(key) == mtimes[key] for key in mtimes):
+				return 0
+
+			with timer(self.stats, "catalog"):
+				titles = {}
+				if mtimes["summary"]:
+					with open(summary) as f:
+						titles = json.load(f)
+
+				rows = dict((name, (size, mtime, paragraphs is not None)) for name, size, mtime, paragraphs in con.execute("SELECT name, size, mtime, paragraphs FROM templates"))
+				names = sorted(name for name in os.listdir(self.directory) if name.endswith(".txt"))
+				updated = 0
+				with con:
+					# Remove deleted templates first so that new ones fill the numbers they leave.
+					for name in set(rows) - set(names):
+						self.remove(name)
+
+					for name in names:
+						template = self.directory + name
+						st = os.stat(template)
+						row = rows.get(name)
+						if row and row[:2] == (st.st_size, st.st_mtime) and (row[2] or not full):
+							continue
+						self.update(name, template, st, titles.get(name, name))
+						updated += 1
+
+					# Titles not found in summary.json default to the filename.
+					if meta.get("summary") != mtimes["summary"] and rows:
+						con.executemany("UPDATE templates SET title = ? WHERE name = ?", [(titles.get(name, name), name) for name in names])
+					con.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", mtimes.items())
+
+			return updated
+
+
+	def update(self, name, template, st, title):
+		"""Store the catalog entry of a new or changed template.
+		Args:
+			name (string): filename of the template
+			template (string): path to the template
+			st (posix.stat_result): result of os.stat() on the template
+			title (string): title of the template
+		"""
+		con = self.connect()
+		with open(template, "rb") as f:
+			digest = hashlib.md5(f.read()).hexdigest()
+
+		# Counts are only known for templates in the index.
+		entry = self.index.lookup(template)
+		paragraphs = None
+		slots = {}
+		if entry and entry["hash"] == digest:
+			paragraphs = len(entry["paragraphs"])
+			for p in entry["paragraphs"]:
+				for tag in p["slots"]:
+					slots[tag] = slots.get(tag, 0) + len(p["slots"][tag])
+
+		# Update in place to keep the template's number, new templates are numbered last.
+		row = (title, st.st_size, st.st_mtime, digest, paragraphs, name)
+		if not con.execute("UPDATE templates SET title = ?, size = ?, mtime = ?, hash = ?, paragraphs = ? WHERE name = ?", row).rowcount:
+			con.execute("INSERT INTO templates (title, size, mtime, hash, paragraphs, name) VALUES (?, ?, ?, ?, ?, ?)", row)
+		con.execute("DELETE FROM slots WHERE name = ?", (name,))
+		con.executemany("INSERT INTO slots VALUES (?, ?, ?)", [(name, tag, n) for tag, n in slots.items()])
+
+
+	def remove(self, name):
+		"""Remove a template from the catalog. The last template takes its number so the numbers stay contiguous.
+		Arg:
+			name (string): filename of the template
+		"""
+		con = self.connect()
+		row = con.execute("SELECT id FROM templates WHERE name = ?", (name,)).fetchone()
+		if row is None:
+			return
+		con.execute("DELETE FROM templates WHERE id = ?", row)
+		con.execute("DELETE FROM slots WHERE name = ?", (name,))
+		con.execute("UPDATE templates SET id = ? WHERE id = (SELECT MAX(id) FROM templates) AND id > ?", (row[0], row[0]))
+
+
+	def check(self, template):
+		"""Update the catalog entry of a template if the file has changed since it was cataloged,
+		or if it has been indexed since. Picks up templates edited in place.
+		Arg:
+			template (string): path to the template
+		"""
+		with self.lock:
+			self.ensure()
+			con = self.connect()
+			name = os.path.basename(template)
+			if os.path.abspath(self.directory + name) != os.path.abspath(template):
+				return
+			st = os.stat(template)
+			row = con.execute("SELECT title, size, mtime, paragraphs FROM templates WHERE name = ?", (name,)).fetchone()
+			if row and row[1:3] == (st.st_size, st.st_mtime) and row[3] is not None:
+				return
+			with con:
+				self.update(name, template, st, row[0] if row else name)
+
+
+	def ensure(self):
+		"""Refresh the catalog if it hasn't been checked yet in this process."""
+		with self.lock:
+			if not self.checked:
+				self.refresh()
+
+
+	def templates(self):
+		"""Return:
+			paths to all templates, sorted by filename
+		"""
+		with self.lock:
+			self.ensure()
+			return [self.directory + name for name, in self.connect().execute("SELECT name FROM templates ORDER BY name")]
+
+
+	def pick(self, rng = random):
+		"""Pick a random template.
+		Arg:
+			rng (random.Random): source of random choices, defaults to the random module
+		Return:
+			path to the template
+		"""
+		with self.lock:
+			self.ensure()
+			con = self.connect()
+			n = con.execute("SELECT MAX(id) FROM templates").fetchone()[0]
+			if not n:
+				raise IndexError("No templates in " + self.directory)
+			# Draw the number the way random.choice() does.
+			name, = con.execute("SELECT name FROM templates WHERE id = ?", (int(rng.random() * n) + 1,)).fetchone()
+			return self.directory + name
+
+
+	def find(self, name):
+		"""Look up a template by filename.
+		Arg:
+			name (string): filename of the template
+		Return:
+			path to the template, or None if it isn't in the catalog
+		"""
+		with self.lock:
+			self.ensure()
+			row = self.connect().execute("SELECT name FROM templates WHERE name = ?", (name,)).fetchone()
+			return self.directory + row[0] if row else None
+
+
+	def title(self, template):
+		"""Look up the title of a template.
+		Arg:
+			template (string): path to the template
+		Return:
+			the title from summary.json, or the filename if it has none
+		"""
+		with self.lock:
+			self.ensure()
+			name = os.path.basename(template)
+			row = self.connect().execute("SELECT title FROM templates WHERE name = ?", (name,)).fetchone()
+			return row[0] if row else name
+
+
+
+class SkeletonCache():
+	"""A bounded LRU cache of rendered letter skeletons. A skeleton is the html of a template
+	run through markdown once, with every word that may be changed and every name placeholder
+	replaced by a sentinel. Rendering a letter then only needs to substitute the words and
+	names into the skeleton instead of running markdown on the whole letter.
+	"""
+
+	# Sentinels for slots, private use characters around the number of the slot.
+	SENTINEL = u"\ue000{}\ue001"
+	PATTERN = re.compile(u"\ue000(\\d+)\ue001")
+
+	def __init__(self, size = 128, stats = None):
+		"""Args:
+			size (int): maximum number of skeletons to keep
+			stats (Stats): collects cache hits and misses, None to disable
+		"""
+		self.size = size
+		self.stats = stats
+		self.skeletons = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+
+	def get(self, template, entry):
+		"""Return the skeleton of a template, building it on a cache miss.
+		Args:
+			template (string): path to the template file
+			entry (dict): the template's entry in the TemplateIndex
+		Return:
+			a list of html chunks alternating with slots: (paragraph_idx, word_idx, original word)
+			tuples for words and class attribute strings for name placeholders
+		"""
+		key = (template, entry["hash"])
+		try:
+			skeleton = self.skeletons.pop(key)
+			self.hits += 1
+			count(self.stats, "skeleton_hits")
+		except KeyError:
+			skeleton = self.build(entry)
+			self.misses += 1
+			count(self.stats, "skeleton_misses")
+			if len(self.skeletons) >= self.size:
+				self.skeletons.popitem(last=False)
+
+		self.skeletons[key] = skeleton
+		return skeleton
+
+
+	def build(self, entry):
+		"""Create the skeleton of a template, see get().
+		Arg:
+			entry (dict): the template's entry in the TemplateIndex
+		Return:
+			the skeleton
+		"""
+		slots = []
+		letter = []
+		for pidx, p in enumerate(entry["paragraphs"]):
+			text = p["text"]
+			splices = [(start, end, cls) for start, end, cls in p["names"]]
+			for idx in sorted(set(idx for tag in p["slots"] for idx in p["slots"][tag])):
+				start, end = p["spans"][idx]
+				splices.append((start, end, (pidx, idx, cgi.escape(text[start:end]))))
+
+			cursor = 0
+			for start, end, slot in sorted(splices):
+				letter.append(text[cursor:start])
+				letter.append(SkeletonCache.SENTINEL.format(len(slots)))
+				slots.append(slot)
+				cursor = end
+
+			letter.append(text[cursor:])
+			letter.append("\n")
+
+		# Join the paragraphs together, dropping the last newline.
+		letter = "".join(letter[:-1])
+
+		# Process to html via markdown and remove extra newline characters between paragraphs.
+		import markdown
+		with timer(self.stats, "markdown"):
+			letter = markdown.markdown(letter)
+		letter = letter.replace("\n", "")
+
+		# Split the html to chunks, every other one being the number of a slot.
+		skeleton = SkeletonCache.PATTERN.split(letter)
+		for i in range(1, len(skeleton), 2):
+			skeleton[i] = slots[int(skeleton[i])]
+		return skeleton
+
+
+
+#==================================================================================
+# Tagger =
+#=========
+# The nltk perceptron tagger, loaded once per process by get_tagger().
+tagger = None
+
+def get_tagger(cache = None):
+	"""Return the nltk perceptron tagger, loading it on first call. Loading nltk's own
+	model goes through nltk.data, so the model is also pickled to a cache file with
+	the highest pickle protocol and read from there on later runs.
+	Arg:
+		cache (string): path to the cache file, None to not use a cache
+	Return:
+		an nltk.tag.PerceptronTagger
+	"""
+	global tagger
+	if tagger is not None:
+		return tagger
+
+	import nltk
+	from nltk.tag.perceptron import PerceptronTagger
+
+	# The cache is tied to the nltk version that created it.
+	if cache and os.path.isfile(cache):
+		try:
+			with open(cache, "rb") as f:
+				version, weights, tagdict, classes = cPickle.load(f)
+			if version == nltk.__version__:
+				tagger = PerceptronTagger(load=False)
+				tagger.model.weights = weights
+				tagger.model.classes = classes
+				tagger.tagdict = tagdict
+				tagger.classes = classes
+				return tagger
+		except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+			pass
+
+	tagger = PerceptronTagger()
+	if cache:
+		try:
+			with open(cache, "wb") as f:
+				cPickle.dump((nltk.__version__, tagger.model.weights, tagger.tagdict, tagger.classes), f, cPickle.HIGHEST_PROTOCOL)
+		except IOError:
+			pass
+	return tagger
+
+
+
+class LookupTagger():
+	"""A fast tagger for short user submissions. Each token is tagged, in order of preference,
+	from a bounded LRU memo of earlier results keyed by the token and its neighbours, from a
+	lexicon of words having a single class in dictionary.db, or by the nltk tagger. The nltk
+	tagger is only run on sentences with tokens left untagged, and its results are memoized.
+	"""
+
+	def __init__(self, fallback, lexicon, size = 4096, stats = None):
+		"""Args:
+			fallback (function): returns the tagger for tokens not in the memo or the lexicon, eg. get_tagger.
+				Called only when needed, so nltk isn't loaded for input covered by the memo and the lexicon.
+			lexicon (dict): lowercase words mapped to their only nltk tag, see read_lexicon()
+			size (int): maximum number of results to memoize
+			stats (Stats): collects hits of the memo and the lexicon and fallback taggings, None to disable
+		"""
+		self.fallback = fallback
+		self.lexicon = lexicon
+		self.size = size
+		self.stats = stats
+		self.memo = collections.OrderedDict()
+
+
+	@staticmethod
+	def load(con, db, cache = None):
+		"""Read the lexicon from the cache, or from the database if the cache is missing or
+		older than the database.
+		Args:
+			con (sqlite3.Connection): connection to dictionary.db
+			db (string): path to dictionary.db
+			cache (string): path to the cache file, None to not use a cache
+		Return:
+			the lexicon, see read_lexicon()
+		"""
+		st = os.stat(db)
+		key = (st.st_mtime, st.st_size)
+		if cache and os.path.isfile(cache):
+			try:
+				with open(cache, "rb") as f:
+					cached_key, lexicon = cPickle.load(f)
+				if cached_key == key:
+					return lexicon
+			except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+				pass
+
+		lexicon = LookupTagger.read_lexicon(con)
+		if cache:
+			try:
+				with open(cache, "wb") as f:
+					cPickle.dump((key, lexicon), f, cPickle.HIGHEST_PROTOCOL)
+			except IOError:
+				pass
+		return lexicon
+
+
+	@staticmethod
+	def read_lexicon(con):
+		"""Read the words that have only one class in the database.
+		Arg:
+			con (sqlite3.Connection): connection to dictionary.db
+		Return:
+			a dict of lowercase words mapped to their nltk tag
+		"""
+		cur = con.execute("SELECT lower(word), MIN(class) FROM dictionary GROUP BY lower(word) HAVING COUNT(DISTINCT class) = 1")
+		return dict(cur)
+
+
+	def tag_sents(self, sentences):
+		"""Tag a list of tokenized sentences, see nltk.tag.api.TaggerI.tag_sents().
+		Arg:
+			sentences (list): lists of tokens
+		Return:
+			a list of lists of (token, tag) tuples
+		"""
+		tagged_sentences = []
+		unknown = []  # indices of sentences with tokens left for the fallback tagger
+		for tokens in sentences:
+			tags = []
+			for idx, token in enumerate(tokens):
+				key = self.context(tokens, idx)
+				tag = self.memo.pop(key, None)
+				if tag is not None:
+					self.memo[key] = tag  # move to the end as the latest used
+					count(self.stats, "tag_memo_hits")
+				else:
+					tag = self.lexicon.get(token.lower())
+					if tag is not None:
+						count(self.stats, "tag_lexicon_hits")
+				tags.append(tag)
+
+			if None in tags:
+				unknown.append(len(tagged_sentences))
+			tagged_sentences.append(tags)
+
+		# Tag the sentences with unknown tokens in one call. The whole sentence is tagged
+		# to give the tagger its context.
+		if unknown:
+			results = self.fallback().tag_sents([sentences[i] for i in unknown])
+			for i, tagged in zip(unknown, results):
+				tokens = sentences[i]
+				tags = tagged_sentences[i]
+				for idx, (token, tag) in enumerate(tagged):
+					if tags[idx] is None:
+						tags[idx] = tag
+						self.remember(self.context(tokens, idx), tag)
+						count(self.stats, "tag_fallback")
+
+		return [zip(tokens, tags) for tokens, tags in zip(sentences, tagged_sentences)]
+
+
+	@staticmethod
+	def context(tokens, idx):
+		"""Return:
+			the memo key of a token: a tuple of the previous token, the token and the next token
+		"""
+		prev = tokens[idx - 1] if idx > 0 else None
+		next = tokens[idx + 1] if idx + 1 < len(tokens) else None
+		return (prev, tokens[idx], next)
+
+
+	def remember(self, key, tag):
+		"""Memoize a tag, dropping the least recently used result if the memo is full."""
+		if len(self.memo) >= self.size:
+			self.memo.popitem(last=False)
+		self.memo[key] = tag
+
+
+
+#==================================================================================
+# Batch workers =
+#================
+# A LetterRandomizer for each process in the pool of generate_batch().
+worker = None
+
+def init_worker(path, wd, weighted=False):
+	"""Initialize a pool process with its own LetterRandomizer. Loads the nltk tagger
+	and opens the database connection up front so they stay warm between letters.
+	"""
+	global worker
+	random.seed()  # don't share the parent's random state between workers
+	worker = LetterRandomizer(path, wd, weighted=weighted)
+	worker.get_sampler()
+	worker.get_tagger()
+
+
+def generate_worker(job):
+	"""Generate a letter in a pool process, see LetterRandomizer.generate().
+	Arg:
+		job (tuple): a (template, seed) tuple
+	"""
+	template, seed = job
+	return worker.generate(template, seed)
+
+
+
 #==================================================================================
 # Main =
 #=======
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(description="Letter randomizer.")
 	parser.add_argument("--init", help="Initialize a random template letter file for processing. Overwrites previous files in /data.", action="store_true")
-	parser.add_argument("--generate", help="Generate a random letter.", action="store_true")
+	parser.add_argument("--generate", help="Generate N random letters, 1 if omitted.", nargs="?", const=1, type=int, metavar="N")
+	parser.add_argument("--workers", help="Number of processes to use with --generate.", type=int, default=1, metavar="K")
 	parser.add_argument("--fill-missing", help="Fill all missing words with entries from database.", action="store_true")
 	parser.add_argument("--parse-input", help="Parse string <input> for words to fill gaps in the current letter.", metavar="input")
 	parser.add_argument("--show", help="Show contents of change_frame.json.", action="store_true")
+	parser.add_argument("--build-index", help="Tokenize and tag all templates to data/index/ and catalog them to data/catalog.db.", action="store_true")
+	parser.add_argument("--weighted", help="Draw database words weighted by their frequency or rating in dictionary.db.", action="store_true")
+	parser.add_argument("--compile-dictionary", help="Compile dictionary.db to the memory mapped dictionary.lex for faster loading.", action="store_true")
+	parser.add_argument("--output", help="Where to store generated letters: file (default), stdout, jsonl:<path>, sqlite:<path> or tar:<path>.", default="file", metavar="sink")
+	parser.add_argument("--session", help="Work on the letter with ID <id> in data/sessions.db instead of change_frame.json.", metavar="id")
+	parser.add_argument("--seed", help="Seed for random choices. The same seed, template and input always produce the same letter.", type=int, metavar="S")
+	parser.add_argument("--stats", help="Print timings and counters of each stage as json when done.", action="store_true")
+	parser.add_argument("--bench", help="Benchmark each stage of generating letters, results are printed as json.", action="store_true")
+	parser.add_argument("--bench-rounds", help="Number of letters to generate from each template with --bench.", type=int, default=3, metavar="R")
+	parser.add_argument("--bench-output", help="Write --bench results to <path> instead of stdout.", metavar="path")
 	args = parser.parse_args()
 
-	randomizer = LetterRandomizer("/home/pi/python/letters/")
+	randomizer = LetterRandomizer("/home/pi/python/letters/", stats=Stats() if args.stats else None, seed=args.seed, session=args.session, weighted=args.weighted)
+	randomizer.sink = sinks.open_sink(args.output, randomizer.wd)
 
 	if args.init:
 		print "Initializing..."
-		files = glob.glob(randomizer.base + "templates/*.txt")
-		letter = random.choice(files)
+		randomizer.reseed(0)
+		letter = randomizer.catalog.pick(randomizer.rng)
 		print "Using", letter
 		randomizer.parse_letter(letter)
 		print "Template data stored in " + randomizer.wd
 		print "Use --parse-input or --fill-missing to enter input for the letter."
 
-	elif args.generate:
+	elif args.generate == 1 and args.workers == 1:
 		title, path = randomizer.randomize_letter()
-		print "Stored at " + path
+		if path:
+			print "Stored at " + path
+
+	elif args.generate:
+		print "Generating {} letters with {} workers...".format(args.generate, args.workers)
+		letters = randomizer.generate_batch(args.generate, workers=args.workers)
+		for title, letter in letters:
+			randomizer.sink.write(title, letter)
+		print "Stored to " + args.output
 
 	elif args.fill_missing:
 		try:
 			print "Fetching missing words from the database..." 
 			randomizer.fill_missing()
 			letter = randomizer.compose_letter()
-			print "Generated a new letter at " + letter
+			if letter:
+				print "Generated a new letter at " + letter
 		except IOError as e:
 			print e
 			print "Initialize first with --init"
@@ -561,10 +2015,28 @@ if __name__ == "__main__":
 		except IOError:
 			print "There's nothing to show. Initialize first with --init"
 
+	elif args.build_index:
+		print "Indexing templates..."
+		n = randomizer.index.build(randomizer.catalog.templates())
+		randomizer.catalog.refresh(full=True)
+		print "Updated {} templates in {}".format(n, randomizer.index.path)
+
+	elif args.compile_dictionary:
+		print "Compiling dictionary..."
+		n = randomizer.compile_dictionary()
+		print "Stored {} words to {}dictionary.lex".format(n, randomizer.base)
+
+	elif args.bench:
+		import benchmark
+		benchmark.main(randomizer.base, args.bench_rounds, args.bench_output)
 
 	else:
 		parser.print_help()
 
+	randomizer.sink.close()
+	if randomizer.stats:
+		print json.dumps(randomizer.stats.summary(), indent=2, sort_keys=True)
+
 
 
 
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""
+lexicon.py
+A compact, read-only snapshot of the words in dictionary.db. compile_lexicon()
+groups the words of each nltk tag into a contiguous pool of utf8 strings with an
+array of offsets, and MappedLexicon samples words straight from a memory map of
+the file. Loading costs no more than opening the file, and any number of worker
+processes share the same page cached copy.
+
+File layout, all integers are unsigned 32 bit little endian:
+	header:  magic "LEX1", number of tags
+	tags:    for each tag: the tag as 8 bytes padded with nulls, number of words,
+	         file offset of the tag's offset array
+	offsets: for each tag: number of words + 1 file offsets of its words in the pool,
+	         word i spans offsets[i]:offsets[i+1]
+	pool:    the utf8 encoded words
+
+Usage:
+	python letters.py --compile-dictionary
+"""
+
+import mmap
+import random
+import struct
+import os
+
+import sqlite3 as lite
+
+
+MAGIC = "LEX1"
+HEADER = struct.Struct("<4sI")
+TAG = struct.Struct("<8sII")
+OFFSET = struct.Struct("<I")
+SPAN = struct.Struct("<II")
+
+
+def compile_lexicon(db_path, path, tags):
+	"""Compile the words of the given tags in dictionary.db to a lexicon file. The file is
+	written to a temporary file first and renamed in place, so readers never see a half
+	written lexicon.
+	Args:
+		db_path (string): path to dictionary.db
+		path (string): path to the lexicon file
+		tags (tuple): nltk tags to include
+	Return:
+		the number of words written
+	"""
+	words = dict((tag, []) for tag in tags)
+	con = lite.connect(db_path)
+	try:
+		placeholders = ", ".join(["?"] * len(tags))
+		cur = con.execute("SELECT word, class FROM dictionary WHERE class IN (" + placeholders + ")", tags)
+		for word, tag in cur:
+			words[tag].append(word.encode("utf8"))
+	finally:
+		con.close()
+
+	# Tags without words are left out, sampling them raises a KeyError like letters.WordSampler does.
+	tags = [tag for tag in tags if words[tag]]
+
+	# The offset arrays follow the tag table, the pool follows the offset arrays.
+	table_end = HEADER.size + TAG.size * len(tags)
+	n = sum(len(words[tag]) for tag in tags)
+	pool_start = table_end + OFFSET.size * (n + len(tags))
+
+	table = []
+	offsets = []
+	array_start = table_end
+	cursor = pool_start
+	for tag in tags:
+		table.append(TAG.pack(tag, len(words[tag]), array_start))
+		array_start += OFFSET.size * (len(words[tag]) + 1)
+		offsets.append(OFFSET.pack(cursor))
+		for word in words[tag]:
+			cursor += len(word)
+			offsets.append(OFFSET.pack(cursor))
+
+	tmp = path + ".tmp"
+	with open(tmp, "wb") as f:
+		f.write(HEADER.pack(MAGIC, len(tags)))
+		f.write("".join(table))
+		f.write("".join(offsets))
+		for tag in tags:
+			f.write("".join(words[tag]))
+	os.rename(tmp, path)
+
+	return n
+
+
+
+class MappedLexicon():
+	"""Draws random words of a given nltk tag from a memory mapped lexicon file,
+	see compile_lexicon(). Has the same interface as letters.WordSampler.
+	"""
+
+	def __init__(self, path, rng = random):
+		"""Map the file and read its tag table.
+		Args:
+			path (string): path to the lexicon file
+			rng (random.Random): source of random choices, defaults to the random module
+		"""
+		self.rng = rng
+		with open(path, "rb") as f:
+			self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, ntags = HEADER.unpack_from(self.data, 0)
+		if magic != MAGIC:
+			raise ValueError("Not a lexicon file: " + path)
+
+		# Map each tag to the number of its words and the offset of its offset array.
+		self.tags = {}
+		for i in range(ntags):
+			tag, n, start = TAG.unpack_from(self.data, HEADER.size + TAG.size * i)
+			if n:
+				self.tags[tag.rstrip("\0")] = (n, start)
+
+
+	def word(self, tag, i):
+		"""Read a word from the pool.
+		Args:
+			tag (string): nltk tag of the word
+			i (int): index of the word within its tag
+		Return:
+			the word
+		"""
+		n, start = self.tags[tag]
+		if not 0 <= i < n:
+			raise IndexError("Word index out of range for {}: {}".format(tag, i))
+		begin, end = SPAN.unpack_from(self.data, start + OFFSET.size * i)
+		return self.data[begin:end].decode("utf8")
+
+
+	def sample(self, tags):
+		"""Draw a random word for each tag.
+		Arg:
+			tags (list): nltk tags of the words to draw
+		Return:
+			a list of words in the same order as tags
+		"""
+		# Draw the index the way random.choice() does, so a seed gives the same words as letters.WordSampler.
+		return [self.word(tag, int(self.rng.random() * self.tags[tag][0])) for tag in tags]
+
+
+	def close(self):
+		self.data.close()
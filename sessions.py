@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""
+sessions.py
+Stores the change frames of many letters in progress at once. Each letter is a
+session identified by a string ID, kept in a SQLite database in WAL mode so the
+bot, the command line and the letter service can read and update different
+letters at the same time.
+
+A session is a row in the sessions table and one row per word to change in the
+slots table. Entering a word updates only the row of its slot.
+"""
+
+import time
+
+import sqlite3 as lite
+
+
+class SessionStore():
+	"""Change frames of letters in progress, keyed by session ID."""
+
+	def __init__(self, path):
+		"""Open the database and create the tables if needed.
+		Arg:
+			path (string): path to the database
+		"""
+		self.path = path
+		# Callers such as letterd.py use the store from several threads one at a time.
+		self.con = lite.connect(path, timeout=30, check_same_thread=False)
+		self.con.execute("PRAGMA journal_mode=WAL")
+		with self.con:
+			self.con.execute("""CREATE TABLE IF NOT EXISTS sessions (
+				id TEXT PRIMARY KEY,
+				title TEXT,
+				file TEXT,
+				filled INTEGER,
+				updated REAL
+			)""")
+			self.con.execute("""CREATE TABLE IF NOT EXISTS slots (
+				session TEXT,
+				position INTEGER,
+				pidx INTEGER,
+				idx INTEGER,
+				tag TEXT,
+				word TEXT,
+				seq INTEGER,
+				PRIMARY KEY (session, pidx, idx)
+			)""")
+
+
+	def create(self, session, frame):
+		"""Start a session from a new change frame, replacing any previous session with the same ID.
+		Args:
+			session (string): the session ID
+			frame (letters.ChangeFrame): the change frame
+		"""
+		slots = [(session, position, pidx, idx, tag, None, None) for position, (pidx, idx, tag) in enumerate(frame.get_slots() or [])]
+		with self.con:
+			self.con.execute("DELETE FROM slots WHERE session = ?", (session,))
+			self.con.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)", (session, frame.title, frame.file, 0, time.time()))
+			self.con.executemany("INSERT INTO slots VALUES (?, ?, ?, ?, ?, ?, ?)", slots)
+		self.save(session, frame)
+
+
+	def save(self, session, frame):
+		"""Store the words entered to a change frame. Only the slots without a word are updated,
+		so a word entered by another process is never overwritten, and a filled session stays filled.
+		Args:
+			session (string): the session ID
+			frame (letters.ChangeFrame): the change frame
+		"""
+		# Remember the order the words were entered in.
+		words = [(word, seq, session, pidx, idx) for seq, (pidx, idx, word) in enumerate(frame.input)]
+		with self.con:
+			self.con.executemany("UPDATE slots SET word = ?, seq = ? WHERE session = ? AND pidx = ? AND idx = ? AND word IS NULL", words)
+			self.con.execute("UPDATE sessions SET filled = MAX(filled, ?), updated = ? WHERE id = ?", (frame.slots is None, time.time(), session))
+
+
+	def load(self, session):
+		"""Read a change frame.
+		Arg:
+			session (string): the session ID
+		Return:
+			the change frame as a dict of {title, file, change_frame, input}, see letters.ChangeFrame.from_dict()
+		"""
+		row = self.con.execute("SELECT title, file, filled FROM sessions WHERE id = ?", (session,)).fetchone()
+		if row is None:
+			raise IOError("No such session: {}".format(session))
+		title, template, filled = row
+
+		change_frame = []
+		input_ = []
+		for pidx, idx, tag, word, seq in self.con.execute("SELECT pidx, idx, tag, word, seq FROM slots WHERE session = ? ORDER BY position", (session,)):
+			if word is None:
+				change_frame.append((pidx, idx, tag))
+			else:
+				input_.append((seq, (pidx, idx, word)))
+		input_ = [word for seq, word in sorted(input_)]
+
+		return {"title":title, "file":template, "change_frame":None if filled else change_frame, "input":input_}
+
+
+	def delete(self, session):
+		"""Remove a session.
+		Arg:
+			session (string): the session ID
+		"""
+		with self.con:
+			self.con.execute("DELETE FROM slots WHERE session = ?", (session,))
+			self.con.execute("DELETE FROM sessions WHERE id = ?", (session,))
+
+
+	def list(self):
+		"""Return:
+			a list of (session ID, title, filled) tuples of all sessions, latest updated first
+		"""
+		return [(session, title, bool(filled)) for session, title, filled in self.con.execute("SELECT id, title, filled FROM sessions ORDER BY updated DESC")]
+
+
+	def close(self):
+		self.con.close()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+"""
+sinks.py
+Output sinks for generated letters. LetterRandomizer.compose_letter() passes each
+finished letter to a sink, which decides where it ends up:
+* FileSink - a .txt file per letter in a folder (the default),
+* MemorySink - kept in memory,
+* StdoutSink - printed to stdout,
+* JsonlSink - appended to a JSON lines file,
+* SqliteSink - inserted to a SQLite database,
+* TarSink - added to a tar archive.
+
+All sinks have the same interface: write(title, letter) stores a letter and
+close() flushes any buffered letters. The bulk sinks buffer letters and write
+them in batches.
+"""
+
+import codecs
+import json
+import sys
+import time
+import io
+import os.path
+import tarfile
+
+import sqlite3 as lite
+
+
+class FileSink():
+	"""Stores each letter as an html-tagged .txt file named by title and date."""
+
+	def __init__(self, wd):
+		"""Arg:
+			wd (string): folder to store the letters to
+		"""
+		self.wd = wd
+
+
+	def write(self, title, letter):
+		"""Store a letter to a new file. A running number is added to the filename
+		if a letter with the same title was already stored on the same day.
+		Args:
+			title (string): title of the letter
+			letter (string): the html-tagged letter
+		Return:
+			the filepath to the generated file
+		"""
+		fname = letter_filename(title)[:-len(".txt")]
+		path = self.wd + fname + ".txt"
+		n = 1
+		while os.path.isfile(path):
+			n += 1
+			path = self.wd + fname + "_" + str(n) + ".txt"
+
+		with codecs.open(path, "w", encoding="utf8") as f:
+			f.write(letter)
+
+		return path
+
+
+	def close(self):
+		pass
+
+
+
+class MemorySink():
+	"""Keeps the letters in memory as a list of (title, letter) tuples."""
+
+	def __init__(self):
+		self.letters = []
+
+
+	def write(self, title, letter):
+		"""Store a letter.
+		Return:
+			the letter
+		"""
+		self.letters.append((title, letter))
+		return letter
+
+
+	def close(self):
+		pass
+
+
+
+class StdoutSink():
+	"""Prints each letter to stdout on its own line."""
+
+	def __init__(self, stream=sys.stdout):
+		self.stream = codecs.getwriter("utf8")(stream)
+
+
+	def write(self, title, letter):
+		"""Print a letter."""
+		self.stream.write(letter + u"\n")
+
+
+	def close(self):
+		self.stream.flush()
+
+
+
+class JsonlSink():
+	"""Appends the letters to a file as JSON lines of {title, time, letter}."""
+
+	def __init__(self, path, buffer_size=100):
+		"""Args:
+			path (string): path to the file
+			buffer_size (int): number of letters to buffer before writing
+		"""
+		self.path = path
+		self.buffer_size = buffer_size
+		self.buffer = []
+
+
+	def write(self, title, letter):
+		"""Buffer a letter to be written.
+		Return:
+			path to the file
+		"""
+		self.buffer.append(json.dumps({"title":title, "time":time.time(), "letter":letter}))
+		if len(self.buffer) >= self.buffer_size:
+			self.flush()
+		return self.path
+
+
+	def flush(self):
+		"""Write buffered letters to file."""
+		if not self.buffer:
+			return
+		with open(self.path, "a") as f:
+			f.write("\n".join(self.buffer) + "\n")
+		self.buffer = []
+
+
+	def close(self):
+		self.flush()
+
+
+
+class SqliteSink():
+	"""Inserts the letters to a letters table in a SQLite database."""
+
+	def __init__(self, path, buffer_size=500):
+		"""Args:
+			path (string): path to the database, created if it doesn't exist
+			buffer_size (int): number of letters to insert in one transaction
+		"""
+		self.path = path
+		self.buffer_size = buffer_size
+		self.buffer = []
+		self.con = lite.connect(path)
+		with self.con:
+			self.con.execute("CREATE TABLE IF NOT EXISTS letters (id INTEGER PRIMARY KEY, title TEXT, time REAL, letter TEXT)")
+
+
+	def write(self, title, letter):
+		"""Buffer a letter to be inserted.
+		Return:
+			path to the database
+		"""
+		self.buffer.append((title, time.time(), letter))
+		if len(self.buffer) >= self.buffer_size:
+			self.flush()
+		return self.path
+
+
+	def flush(self):
+		"""Insert buffered letters in a single transaction."""
+		if not self.buffer:
+			return
+		with self.con:
+			self.con.executemany("INSERT INTO letters (title, time, letter) VALUES (?, ?, ?)", self.buffer)
+		self.buffer = []
+
+
+	def close(self):
+		self.flush()
+		self.con.close()
+
+
+
+class TarSink():
+	"""Adds the letters as .txt files to an uncompressed tar archive."""
+
+	def __init__(self, path, buffer_size=100):
+		"""Args:
+			path (string): path to the archive, created if it doesn't exist
+			buffer_size (int): number of letters to buffer before writing
+		"""
+		self.path = path
+		self.buffer_size = buffer_size
+		self.buffer = []
+		self.n = 0
+
+
+	def write(self, title, letter):
+		"""Buffer a letter to be added to the archive.
+		Return:
+			the name of the letter in the archive
+		"""
+		self.n += 1
+		name = "{}_{}_{}.txt".format(title.replace(" ", "_"), time.strftime("%d_%m_%y"), self.n)
+		self.buffer.append((name, letter.encode("utf8")))
+		if len(self.buffer) >= self.buffer_size:
+			self.flush()
+		return name
+
+
+	def flush(self):
+		"""Add buffered letters to the archive."""
+		if not self.buffer:
+			return
+		tar = tarfile.open(self.path, "a")
+		try:
+			for name, data in self.buffer:
+				info = tarfile.TarInfo(name)
+				info.size = len(data)
+				info.mtime = time.time()
+				tar.addfile(info, io.BytesIO(data))
+		finally:
+			tar.close()
+		self.buffer = []
+
+
+	def close(self):
+		self.flush()
+
+
+
+def letter_filename(title):
+	"""Generate a filename for a letter from its title and the current date.
+	Arg:
+		title (string): title of the letter
+	Return:
+		the filename, eg. Cleaner_Cover_Letter_18_10_26.txt
+	"""
+	timestamp = time.strftime("%d.%m.%y")
+	timestamp = timestamp.replace(".", "_")
+	return title.replace(" ", "_") + "_" + timestamp + ".txt"
+
+
+
+def open_sink(spec, wd):
+	"""Create a sink from a command line description.
+	Args:
+		spec (string): one of "file", "memory", "stdout", "jsonl:<path>", "sqlite:<path>" or "tar:<path>"
+		wd (string): folder for the file sink
+	Return:
+		the sink
+	"""
+	kind, _, path = spec.partition(":")
+	if kind == "file":
+		return FileSink(path or wd)
+	if kind == "memory":
+		return MemorySink()
+	if kind == "stdout":
+		return StdoutSink()
+	if kind == "jsonl" and path:
+		return JsonlSink(path)
+	if kind == "sqlite" and path:
+		return SqliteSink(path)
+	if kind == "tar" and path:
+		return TarSink(path)
+	raise ValueError("Invalid output: " + spec)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for uploader.py against a local FTP server. Needs pyftpdlib, the tests are
+skipped without it.
+
+Usage:
+	python -m unittest discover
+"""
+
+import ftplib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import uploader
+
+try:
+	from pyftpdlib.authorizers import DummyAuthorizer
+	from pyftpdlib.handlers import FTPHandler
+	from pyftpdlib.servers import FTPServer
+except ImportError:
+	FTPServer = None
+
+
+@unittest.skipIf(FTPServer is None, "pyftpdlib is not installed")
+class UploaderTest(unittest.TestCase):
+
+	def setUp(self):
+		logging.getLogger("pyftpdlib").setLevel(logging.WARNING)
+		self.home = tempfile.mkdtemp()
+		os.makedirs(os.path.join(self.home, "public_html", "letters", "letters"))
+		self.root = os.path.join(self.home, "public_html", "letters")
+
+		authorizer = DummyAuthorizer()
+		authorizer.add_user("bot", "secret", self.home, perm="elradfmw")
+		class Handler(FTPHandler):
+			pass
+		Handler.authorizer = authorizer
+		self.server = FTPServer(("127.0.0.1", 0), Handler)
+		thread = threading.Thread(target=self.server.serve_forever, kwargs={"timeout":0.1})
+		thread.daemon = True
+		thread.start()
+
+		port = self.server.socket.getsockname()[1]
+		self.uploader = uploader.Uploader("127.0.0.1", "bot", "secret", "/public_html/letters", port=port, timeout=5, retries=2, backoff=0.01)
+
+
+	def tearDown(self):
+		self.uploader.close()
+		self.server.close_all()
+		shutil.rmtree(self.home)
+
+
+	def read(self, path):
+		with open(os.path.join(self.root, path), "rb") as f:
+			return f.read()
+
+
+	def test_commit(self):
+		self.uploader.put("letters/letter.txt", u"<p>Dear J\xf6rg</p>")
+		self.uploader.put("bot_status.json", '{"current_title": "Letter"}')
+		self.uploader.commit()
+
+		self.assertEqual(self.read("letters/letter.txt"), u"<p>Dear J\xf6rg</p>".encode("utf8"))
+		self.assertEqual(self.read("bot_status.json"), '{"current_title": "Letter"}')
+		self.assertEqual(sorted(os.listdir(self.root)), ["bot_status.json", "letters"])
+		self.assertEqual(self.uploader.batch, [])
+
+
+	def test_delete(self):
+		with open(os.path.join(self.root, "user_input.processing.json"), "w") as f:
+			f.write("{}")
+		self.uploader.delete("user_input.processing.json")
+		self.uploader.delete("missing.json")
+		self.uploader.commit()
+		self.assertEqual(os.listdir(self.root), ["letters"])
+
+
+	def test_reconnect(self):
+		self.uploader.connect().sock.close()
+		self.uploader.put("bot_status.json", "{}")
+		self.uploader.commit()
+		self.assertEqual(self.read("bot_status.json"), "{}")
+
+
+	def test_failed_commit_keeps_batch(self):
+		self.uploader.put("bot_status.json", "{}")
+		self.uploader.port = 1
+		self.uploader.close()
+		with self.assertRaises(ftplib.all_errors):
+			self.uploader.commit()
+		self.assertEqual(len(self.uploader.batch), 1)
+		self.assertFalse(os.path.exists(os.path.join(self.root, "bot_status.json")))
+
+
+	def test_rename(self):
+		with open(os.path.join(self.root, "user_input.json"), "w") as f:
+			f.write("{}")
+		self.assertTrue(self.uploader.exists("user_input.json"))
+		self.assertTrue(self.uploader.rename("user_input.json", "user_input.processing.json"))
+		self.assertFalse(self.uploader.exists("user_input.json"))
+		self.assertFalse(self.uploader.rename("user_input.json", "user_input.processing.json"))
+		self.assertEqual(self.read("user_input.processing.json"), "{}")
+
+
+if __name__ == "__main__":
+	unittest.main()
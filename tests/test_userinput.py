@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for userinput.py against a local HTTP stand-in for the web page.
+
+Usage:
+	python -m unittest discover
+"""
+
+import BaseHTTPServer
+import json
+import threading
+import unittest
+
+import userinput
+
+
+class StandIn(BaseHTTPServer.BaseHTTPRequestHandler):
+	"""Serves the body of the server's current document, 404 if there is none."""
+
+	def do_GET(self):
+		body = self.server.document
+		if body is None:
+			self.send_response(404)
+			self.end_headers()
+			return
+		self.send_response(self.server.status)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+	def log_message(self, *args):
+		pass
+
+
+
+class FetchTest(unittest.TestCase):
+
+	def setUp(self):
+		self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), StandIn)
+		self.server.document = None
+		self.server.status = 200
+		thread = threading.Thread(target=self.server.serve_forever)
+		thread.daemon = True
+		thread.start()
+		self.url = "http://127.0.0.1:{}/{}".format(self.server.server_port, userinput.PROCESSING)
+
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+
+	def put(self, entries):
+		self.server.document = json.dumps({"entry":entries, "timestamp":["1.1.2017 12:00:00"] * len(entries), "ip":["127.0.0.1"] * len(entries)})
+
+
+	def test_entries(self):
+		self.put(["The dog", u"caf\xe9"])
+		self.assertEqual(userinput.fetch(self.url), ["The dog", u"caf\xe9"])
+
+
+	def test_empty(self):
+		self.put([])
+		self.assertEqual(userinput.fetch(self.url), [])
+
+
+	def test_missing(self):
+		self.assertIsNone(userinput.fetch(self.url))
+
+
+	def test_error(self):
+		self.put(["The dog"])
+		self.server.status = 500
+		self.assertIsNone(userinput.fetch(self.url))
+
+
+	def test_truncated(self):
+		self.server.document = '{"entry": ["The dog", "The ca'
+		self.assertIsNone(userinput.fetch(self.url))
+
+
+	def test_connection_refused(self):
+		self.tearDown()
+		self.assertIsNone(userinput.fetch(self.url, timeout=1))
+		self.setUp()
+
+
+
+class IterEntriesTest(unittest.TestCase):
+
+	DOCUMENT = json.dumps({"timestamp":[1, 2, 3, 4], "entry":["a \"entry\": [", 12345, [1, {"x":"]"}], u"\xe4"], "ip":[]})
+
+	def chunks(self, size):
+		return (self.DOCUMENT[i:i + size] for i in range(0, len(self.DOCUMENT), size))
+
+
+	def test_chunk_sizes(self):
+		for size in range(1, 16):
+			self.assertEqual(list(userinput.iter_entries(self.chunks(size))), json.loads(self.DOCUMENT)["entry"], size)
+
+
+	def test_number_split_between_chunks(self):
+		self.assertEqual(list(userinput.iter_entries(['{"entry": [1, 2', '3]}'])), [1, 23])
+
+
+	def test_no_array(self):
+		self.assertEqual(list(userinput.iter_entries(['{"timestamp": []}'])), [])
+
+
+	def test_truncated(self):
+		with self.assertRaises(ValueError):
+			list(userinput.iter_entries(['{"entry": ["a", "b']))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -15,25 +15,27 @@ Change log
 """
 
 import json
-import twython
-import pprint
-import glob
+import ftplib
 import random
 import argparse
 import sys
-import requests
-import ftplib
 import os
 import logging
 
 import letters
+import sinks
+import uploader
+import userinput
 
 #==================================================================================
 # Global constants =
 #==================
 
-# Create a LetterRandomizer with working directory in bot-data 
-letter_randomizer = letters.LetterRandomizer("/home/pi/python/letters/", "bot-data/")
+# Create a LetterRandomizer with working directory in bot-data,
+# timings of each stage are logged to letters.log. Letters are kept in memory
+# and uploaded directly from there. Receiver and signature names are prefetched
+# from behindthename.com, the local names/names.json is only a fallback.
+letter_randomizer = letters.LetterRandomizer("/home/pi/python/letters/", "bot-data/", name_prefetch=4, sink=sinks.MemorySink(), stats=letters.Stats(log=True))
 path = letter_randomizer.base  # path to the base folder /home/pi/python/letters/
 bot_path = letter_randomizer.wd  # path to bot related files: keys.json, bot_status.json and those created by letter_randomizer
 
@@ -46,45 +48,60 @@ OAUTH_TOKEN = KEYS["OAUTH_TOKEN"]
 OAUTH_SECRET = KEYS["OAUTH_SECRET"]
 FTP_PASSWD = KEYS["FTP_PASSWD"]
 
-twitter = twython.Twython(API_KEY, API_SECRET, OAUTH_TOKEN, OAUTH_SECRET)
+# Twitter client, created on first use by get_twitter().
+twitter = None
 
 # Setup a logger
 logging.basicConfig(filename=path + "letters.log", format="%(asctime)s %(message)s", level=logging.INFO)
 
 
+# Timeouts in seconds for the steps of a tweet cycle.
+TIMEOUTS = {
+  "fetch": 30,
+  "ftp": 60,
+  "prepare": 120,
+  "tweet": 60
+}
+
+# Number of upcoming templates to keep parsed in template_pool.json.
+POOL_SIZE = 3
+
+# Uploads to the web page, logs in on first commit or connect().
+server = uploader.Uploader("lajanki.mbnet.fi", "lajanki", FTP_PASSWD, "/public_html/letters", timeout=TIMEOUTS["ftp"])
+
+
 #==================================================================================
 # Input parsing =
 #================
-def parse_server_input():
-  """Read any user input entered through the input field at lajanki.mbnet.fi/letters/active.php and
-  parse it for valid words to enter to the current letter template.
+def receive_server_input(url="http://lajanki.mbnet.fi/letters/" + userinput.PROCESSING):
+  """Hand off the user input entered through the input field at lajanki.mbnet.fi/letters/active.php
+  and fetch it, see userinput.py.
+  Arg:
+    url (string): address of the user input file handed off for processing
+  Return:
+    a list of the submissions, or None if there is no user input or it couldn't be read
   """
   try:
-    input_ = []
-    r = requests.get("http://lajanki.mbnet.fi/user_input.json")
-    if r.status_code == requests.codes.ok:
-      res = json.loads(r.text)
-      print "Server input:"
-      pprint.pprint(res)
-      input_.extend(res["entry"])
-    elif r.status_code == requests.codes.not_found:
-      print "user_input.json is empty"
-    else:
-      print "Something went wrong when fetching remote user input. The following response was received:"
-      print r.text
-  except requests.ConnectionError as e:
-    print "Could not connect to server"
-    print e
-  except requests.RequestException as e:
-    print "Something went wrong when requesting user_input.json"
+    if not userinput.claim(server):
+      print "No new user input"
+      return None
+  except ftplib.all_errors as e:
+    print "Could not hand off user input"
     print e
+    return None
+  return userinput.fetch(url, TIMEOUTS["fetch"])
 
+
+def parse_input_list(input_):
+  """Parse a list of submissions for valid words to enter to the current letter template.
+  Arg:
+    input_ (list): the submissions
+  """
   if input_:
     logging.info("Received {} submissions from server.".format(len(input_)))
     # Shuffle and fill the template
     random.shuffle(input_)
-    for item in input_:
-      letter_randomizer.parse_input(item)
+    letter_randomizer.parse_inputs(input_)
 
 
 #==================================================================================
@@ -95,28 +112,85 @@ def init_bot():
   Return:
     the title of the first letter in the index
   """
-  files = glob.glob(path + "templates/*.txt")
-  random.shuffle(files)
-
   bot_status = {}
-  bot_status["run_order"] = files
+  bot_status["run_order"] = []
 
   # Parse the letter to a template.json file.
   init_template(bot_status)
-  logging.info("Initialized the bot.")
+  refill_pool(bot_status)
   
 
 
 def init_template(bot_status):
-  """Process a template file by fetching any user input from the server and
-  filling missing words from the database. Uploads the result to the server
-  and tweets a link to it.
+  """Parse the next template in the run order to the current change frame.
   Arg:
     bot_status (dict): the current status of the bot, a dict of {run_order, current_title}
   """ 
+  install_template(bot_status, prepare_template(bot_status))
+
+
+def prepare_template(bot_status):
+  """Pop the next template from the run order and get its change frame without
+  making it current. The frame is taken from the template pool when available,
+  otherwise the template is parsed. Starts a new shuffled run order when the previous
+  one runs out.
+  Arg:
+    bot_status (dict): the current status of the bot
+  Return:
+    the letters.ChangeFrame for the template
+  """
+  if not bot_status["run_order"]:
+    files = letter_randomizer.catalog.templates()
+    random.shuffle(files)
+    bot_status["run_order"] = files
+    logging.info("Initialized the bot.")
+
   template = bot_status["run_order"].pop()
-  title = letter_randomizer.parse_letter(template) # generates a template.json for this letter 
-  bot_status["current_title"] = title
+  for frame in load_pool():
+    if frame.file == template:
+      return frame
+  return letter_randomizer.make_frame(template)
+
+
+def refill_pool(bot_status):
+  """Parse the next POOL_SIZE templates of the run order to template_pool.json, reusing
+  frames already in the pool. Frames of templates no longer upcoming are dropped.
+  Arg:
+    bot_status (dict): the current status of the bot
+  """
+  upcoming = bot_status["run_order"][-POOL_SIZE:]
+  upcoming.reverse()
+  frames = dict((frame.file, frame) for frame in load_pool())
+  pool = [frames.get(template) or letter_randomizer.make_frame(template) for template in upcoming]
+
+  # Write to a temporary file first so a half written pool is never read.
+  tmp = bot_path + "template_pool.json.tmp"
+  with open(tmp, "w") as f:
+    json.dump([frame.to_dict() for frame in pool], f)
+  os.rename(tmp, bot_path + "template_pool.json")
+
+
+def load_pool():
+  """Read the template pool.
+  Return:
+    a list of letters.ChangeFrame for the upcoming templates, empty if there is no pool
+  """
+  try:
+    with open(bot_path + "template_pool.json") as f:
+      return [letters.ChangeFrame.from_dict(d) for d in json.load(f)]
+  except (IOError, ValueError):
+    return []
+
+
+def install_template(bot_status, frame):
+  """Make a prepared change frame current and store it and bot_status.json.
+  Args:
+    bot_status (dict): the current status of the bot
+    frame (letters.ChangeFrame): the change frame of the next letter
+  """
+  letter_randomizer.state = frame
+  letter_randomizer.save_frame()  # generates a change_frame.json for this letter
+  bot_status["current_title"] = frame.title
 
   # Write bot_status to file.
   with open(bot_path + "bot_status.json", "w") as f:
@@ -128,60 +202,100 @@ def init_template(bot_status):
 #==================================================================================
 # Helper functions =
 #===================
+def get_twitter():
+  """Return a Twitter client, importing twython only when needed."""
+  global twitter
+  if twitter is None:
+    import twython
+    twitter = twython.Twython(API_KEY, API_SECRET, OAUTH_TOKEN, OAUTH_SECRET)
+  return twitter
+
+
+def update_server(title, letter, bot_status, clear_input=False):
+  """Upload a letter and bot_status.json to the server and delete the processed user input
+  in a single batch.
+  Args:
+    title (string): title of the letter
+    letter (string): the html-tagged letter
+    bot_status (dict): the status of the next template
+    clear_input (boolean): whether to delete the user input file, only when it was fetched and parsed
+  """
+  fname = sinks.letter_filename(title)
+  logging.info("Uploading {} to lajanki.mbnet.fi/letters/letters".format(fname))
+  server.put("letters/" + fname, letter)
+
+  # Send bot_status.json to the server in order to know the title of the next
+  # letter.
+  server.put("bot_status.json", json.dumps(bot_status))
+
+  # Delete the processed user input, active.php has started a new user_input.json.
+  if clear_input:
+    server.delete(userinput.PROCESSING)
+  server.commit()
+
+
 def tweet():
   """Fill current template with user input from the server and database words,
-  upload the file to the server and tweet a link to it.
-  Arg:
-    msg (string): the message to tweet
-  Return
-    tweet id
+  upload the letter to the server together with the status of the next template
+  and tweet a link to it.
+
+  Network steps run in a pool of threads while the letter is being processed:
+  fetching user input and preparing the next template run at the same time, as do
+  tweeting and refilling the template pool afterwards.
+  Each step has a timeout, see TIMEOUTS.
   """
+  from multiprocessing.pool import ThreadPool
+  from multiprocessing import TimeoutError
+
   # Get the title of the current template
   with open(bot_path + "bot_status.json") as f:
     bot_status = json.load(f)
     title = bot_status["current_title"] 
 
-  parse_server_input()
-  letter_randomizer.fill_missing()
-  letter_path = letter_randomizer.compose_letter()
-
-  # Upload the file to the server
-  ftp = ftplib.FTP("lajanki.mbnet.fi", "lajanki", FTP_PASSWD)
-  ftp.cwd("/public_html/letters/letters")
+  # Start prefetching names so they arrive while the network steps run.
+  letter_randomizer.get_names()
 
-  with open(letter_path) as f:
-    fname = os.path.basename(letter_path)
-    logging.info("Uploading {} to lajanki.mbnet.fi/letters/letters".format(fname))
-    ftp.storlines("STOR " + fname, f)
-
-  ftp.cwd("/public_html/letters")
-  # Delete user input file from server (the server will create new when needed),
-  # or ignore if it doesn't exist
+  pool = ThreadPool(3)
   try:
-    ftp.delete("user_input.json")
-  except ftplib.error_perm:
-    pass
-
-  # Delete local letter file
-  os.remove(letter_path)
-
-  # Tweet
-  msg = title + "\n" + "http://lajanki.mbnet.fi/letters/active.php"
-  logging.info("Tweet: " + msg)
-  twitter.update_status(status = msg)
-
-  # Initialize the next template.
-  if not bot_status["run_order"]:
-    init_bot()
-
-  else:
-    init_template(bot_status)
-
-  # Send bot_status.json to the server in order to know the title of the next
-  # letter.
-  with open(bot_path + "bot_status.json") as f:
-    ftp.storlines("STOR bot_status.json", f)
-    ftp.quit()
+    # The server connection is only used by receive_server_input() until it returns, its
+    # FTP steps time out on their own within TIMEOUTS["ftp"].
+    fetching = pool.apply_async(receive_server_input)
+    preparing = pool.apply_async(prepare_template, (bot_status,))
+
+    # Fill the template with whatever input arrived in time. Input that couldn't be
+    # fetched is kept on the server and read on the next cycle.
+    input_ = None
+    try:
+      input_ = fetching.get(TIMEOUTS["ftp"] + TIMEOUTS["fetch"])
+      parse_input_list(input_)
+    except TimeoutError:
+      logging.warning("Fetching user input timed out, continuing without it.")
+    letter_randomizer.fill_missing()
+    letter = letter_randomizer.compose_letter()
+
+    counters = letter_randomizer.stats.summary()["counters"]
+    logging.info("Filled {} words from user input and {} from the database.".format(counters.get("slots_input", 0), counters.get("slots_db", 0)))
+
+    # Upload the letter and the status of the next template in one batch. The bot only
+    # moves on to the next template once the upload has succeeded, otherwise the filled
+    # change_frame.json is composed and uploaded again on the next run.
+    frame = preparing.get(TIMEOUTS["prepare"])
+    update_server(title, letter, dict(bot_status, current_title=frame.title), input_ is not None)
+    install_template(bot_status, frame)
+
+    # Tweet while the template pool is refilled.
+    msg = title + "\n" + "http://lajanki.mbnet.fi/letters/active.php"
+    logging.info("Tweet: " + msg)
+    tweeting = pool.apply_async(lambda: get_twitter().update_status(status = msg))
+    refilling = pool.apply_async(refill_pool, (bot_status,))
+
+    tweeting.get(TIMEOUTS["tweet"])
+    refilling.get(TIMEOUTS["prepare"])
+
+  finally:
+    # Don't wait for steps that timed out.
+    pool.close()
+    server.close()
 
 
 
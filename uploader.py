@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+uploader.py
+Uploads files to the web server over FTP. An Uploader keeps one logged in
+connection open for as long as it's needed and sends changes in batches:
+files to upload and to delete are first staged with put() and delete(), then
+sent together by commit().
+
+A commit uploads each file in binary mode from memory to a temporary .part name
+and only renames it to its final name once every file has been sent, so the
+server never shows a half uploaded letter next to a status pointing to it.
+Failed commits are retried on a new connection with an exponential backoff.
+
+Usage:
+	uploader = Uploader("lajanki.mbnet.fi", "lajanki", passwd, "/public_html/letters")
+	uploader.put("letters/letter.txt", data)
+	uploader.put("bot_status.json", status)
+	uploader.delete("user_input.json")
+	uploader.commit()
+	uploader.close()
+"""
+
+import ftplib
+import io
+import time
+import logging
+
+
+class Uploader():
+	"""A reusable FTP connection with batched uploads."""
+
+	def __init__(self, host, user, passwd, root="/", port=21, timeout=60, retries=3, backoff=2):
+		"""Args:
+			host (string): address of the server
+			user (string): username
+			passwd (string): password
+			root (string): folder on the server the staged paths are relative to
+			port (int): port of the server
+			timeout (int): timeout of the connection in seconds
+			retries (int): number of times to retry a failed commit
+			backoff (float): seconds to wait before the first retry, doubled on each retry
+		"""
+		self.host = host
+		self.user = user
+		self.passwd = passwd
+		self.root = root.rstrip("/") + "/"
+		self.port = port
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+		self.ftp = None
+		self.batch = []
+
+
+	def connect(self):
+		"""Log in to the server, or reuse the current connection if it is still alive.
+		Return:
+			the ftplib.FTP connection
+		"""
+		if self.ftp is not None:
+			try:
+				self.ftp.voidcmd("NOOP")
+				return self.ftp
+			except ftplib.all_errors:
+				self.close()
+
+		ftp = ftplib.FTP(timeout=self.timeout)
+		ftp.connect(self.host, self.port)
+		ftp.login(self.user, self.passwd)
+		self.ftp = ftp
+		return ftp
+
+
+	def exists(self, path):
+		"""Check whether a file is on the server.
+		Arg:
+			path (string): path of the file relative to root
+		Return:
+			True if the file exists
+		"""
+		ftp = self.connect()
+		try:
+			ftp.voidcmd("TYPE I")
+			ftp.size(self.root + path)
+			return True
+		except ftplib.error_perm:
+			return False
+
+
+	def rename(self, path, new):
+		"""Rename a file on the server right away, outside of the staged batch.
+		Args:
+			path (string): path of the file relative to root
+			new (string): new path of the file relative to root
+		Return:
+			True if the file was renamed, False if it doesn't exist
+		"""
+		try:
+			self.connect().rename(self.root + path, self.root + new)
+			return True
+		except ftplib.error_perm:
+			return False
+
+
+	def put(self, path, data):
+		"""Stage a file to upload on the next commit.
+		Args:
+			path (string): path of the file relative to root
+			data (string): contents of the file, unicode is encoded as utf8
+		"""
+		if isinstance(data, unicode):
+			data = data.encode("utf8")
+		self.batch.append(("put", path, data))
+
+
+	def delete(self, path):
+		"""Stage a file to delete on the next commit. Missing files are ignored.
+		Arg:
+			path (string): path of the file relative to root
+		"""
+		self.batch.append(("delete", path, None))
+
+
+	def commit(self):
+		"""Send the staged changes to the server. Retries with a new connection on failure.
+		Raises the last error if all retries fail, in which case the batch is kept.
+		"""
+		for attempt in range(self.retries + 1):
+			try:
+				self.send(self.connect())
+				self.batch = []
+				return
+			except ftplib.all_errors as e:
+				self.close()
+				if attempt == self.retries:
+					raise
+				wait = self.backoff * 2 ** attempt
+				logging.warning("Upload failed ({}), retrying in {} seconds.".format(e, wait))
+				time.sleep(wait)
+
+
+	def send(self, ftp):
+		"""Upload the staged files to temporary names, rename them in place and
+		delete the files staged for deletion.
+		Arg:
+			ftp (ftplib.FTP): connection to the server
+		"""
+		puts = [(self.root + path, data) for op, path, data in self.batch if op == "put"]
+		deletes = [self.root + path for op, path, data in self.batch if op == "delete"]
+
+		for path, data in puts:
+			ftp.storbinary("STOR " + path + ".part", io.BytesIO(data))
+
+		for path, data in puts:
+			ftp.rename(path + ".part", path)
+
+		for path in deletes:
+			try:
+				ftp.delete(path)
+			except ftplib.error_perm:
+				pass
+
+
+	def close(self):
+		"""Close the connection, if any."""
+		if self.ftp is None:
+			return
+		try:
+			self.ftp.quit()
+		except ftplib.all_errors:
+			self.ftp.close()
+		self.ftp = None
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+userinput.py
+Reads the words entered through the input field at lajanki.mbnet.fi/letters/active.php.
+active.php appends each submission to user_input.json on the server. At the start of a
+tweet cycle the bot hands the file off by renaming it to user_input.processing.json over
+FTP, so that submissions made from then on go to a new user_input.json. The processing
+file is fetched over HTTP, decoded as it streams in, and deleted together with the upload
+of the letter. A processing file left by a failed cycle is read again on the next one.
+
+Usage:
+	if userinput.claim(uploader):
+		entries = userinput.fetch("http://lajanki.mbnet.fi/letters/" + userinput.PROCESSING)
+"""
+
+import codecs
+import json
+import pprint
+import re
+
+
+INPUT = "user_input.json"
+PROCESSING = "user_input.processing.json"
+
+
+def claim(server):
+	"""Hand off user_input.json for processing, unless an earlier processing file is still on the server.
+	Arg:
+		server (uploader.Uploader): connection to the server
+	Return:
+		True if there is a processing file to fetch
+	"""
+	if server.exists(PROCESSING):
+		return True
+	return server.rename(INPUT, PROCESSING)
+
+
+def fetch(url, timeout=30):
+	"""Fetch the submissions in a user input file. The file is decoded as it streams in.
+	Args:
+		url (string): address of the file
+		timeout (int): timeout of the request in seconds
+	Return:
+		a list of the submissions, or None if the file couldn't be read
+	"""
+	import requests
+	try:
+		r = requests.get(url, timeout=timeout, stream=True)
+		try:
+			if r.status_code == requests.codes.ok:
+				decoder = codecs.getincrementaldecoder("utf8")()
+				input_ = list(iter_entries(decoder.decode(chunk) for chunk in r.iter_content(8192)))
+				print "Server input:"
+				pprint.pprint(input_)
+			else:
+				print "Something went wrong when fetching remote user input. The following response was received:"
+				print r.text
+				input_ = None
+		finally:
+			r.close()
+	except requests.ConnectionError as e:
+		print "Could not connect to server"
+		print e
+		input_ = None
+	except requests.RequestException as e:
+		print "Something went wrong when requesting user input"
+		print e
+		input_ = None
+	except ValueError as e:
+		print "Could not decode user input"
+		print e
+		input_ = None
+
+	return input_
+
+
+def iter_entries(chunks, key="entry"):
+	"""Decode the items of an array in a json object from a stream of text without
+	holding more than the current item and chunk in memory.
+	Args:
+		chunks (iterable): the json document as chunks of text
+		key (string): key of the array
+	Return:
+		a generator of the items of the array
+	"""
+	decoder = json.JSONDecoder()
+	pattern = re.compile(r'"{}"\s*:\s*\['.format(key))
+	chunks = iter(chunks)
+
+	# Find the start of the array, keeping the tail of the text read so far in case
+	# the key is split between chunks.
+	text = ""
+	while True:
+		match = pattern.search(text)
+		if match:
+			break
+		chunk = next(chunks, None)
+		if chunk is None:
+			return
+		text = text[-64:] + chunk
+
+	pos = match.end()
+	while True:
+		while pos < len(text) and text[pos] in " \t\r\n,":
+			pos += 1
+		if pos < len(text) and text[pos] == "]":
+			return
+
+		try:
+			item, end = decoder.raw_decode(text, pos)
+			# A number at the end of the text may continue in the next chunk.
+			complete = end < len(text) or isinstance(item, (basestring, list, dict))
+		except ValueError:
+			item, complete = None, False
+
+		if complete:
+			yield item
+			pos = end
+			continue
+
+		# Read more of the item, or the rest of the array.
+		chunk = next(chunks, None)
+		if chunk is None:
+			if item is not None:
+				yield item
+				return
+			raise ValueError("Unexpected end of user input")
+		text = text[pos:] + chunk
+		pos = 0